@@ -0,0 +1,54 @@
+from rdflib.namespace import OWL
+
+
+class WriteBatch:
+    # The additions and removals of one rule application. Nothing is written
+    # while the rule still iterates over the graph; commit() removes first
+    # and then adds everything with one addN, in the order queued, so the
+    # result does not depend on how the store orders its generators.
+
+    def __init__(self, g):
+        self.g = g
+        self.additions = dict() # ordered set
+        self.removals = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+    def add(self, triple):
+        self.additions[triple] = None
+
+    def remove(self, triple):
+        self.removals[triple] = None
+
+    def rewrite(self, canonical, predicates=False):
+        # every triple of an alias in canonical (alias -> representative)
+        # is moved to the representative exactly once; predicates=True also
+        # rewrites the alias used as predicate. eq-rep-s, eq-rep-o, eq-rep-p
+        affected = dict() # ordered set, in the order the store yields them
+        for x in canonical:
+            affected.update(dict.fromkeys(self.g.triples((x, None, None))))
+            affected.update(dict.fromkeys(self.g.triples((None, None, x))))
+            if predicates:
+                affected.update(dict.fromkeys(self.g.triples((None, x, None))))
+        for s, p, o in affected:
+            self.remove((s, p, o))
+            s = canonical.get(s, s)
+            o = canonical.get(o, o)
+            if predicates:
+                p = canonical.get(p, p)
+            if p == OWL.sameAs and s == o:
+                continue
+            self.add((s, p, o))
+
+    def commit(self):
+        g = self.g
+        for triple in self.removals:
+            g.remove(triple)
+        g.addN((s, p, o, g) for s, p, o in self.additions)
+        self.additions = dict()
+        self.removals = dict()
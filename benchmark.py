@@ -0,0 +1,284 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import subprocess
+import time
+
+import rdflib
+from pyshacl import validate
+
+from fused_graph import fused_graph, noiseless_fused_graph
+
+
+UB = "http://swat.cse.lehigh.edu/onto/univ-bench.owl#"
+OWL_NS = "http://www.w3.org/2002/07/owl#"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+RDFS_NS = "http://www.w3.org/2000/01/rdf-schema#"
+
+
+shapes_graph = '''
+@prefix ub: <http://swat.cse.lehigh.edu/onto/univ-bench.owl#> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+
+ub:UniversityShape a sh:NodeShape ;
+    sh:targetClass ub:University ;
+    sh:property [ sh:path ub:name ; sh:minCount 1 ; sh:maxCount 1 ] .
+
+ub:DepartmentShape a sh:NodeShape ;
+    sh:targetClass ub:Department ;
+    sh:property [ sh:path ub:name ; sh:minCount 1 ; sh:maxCount 1 ] ;
+    sh:property [ sh:path ub:subOrganizationOf ; sh:minCount 1 ; sh:class ub:University ] .
+
+ub:FullProfessorShape a sh:NodeShape ;
+    sh:targetClass ub:FullProfessor ;
+    sh:property [ sh:path ub:name ; sh:minCount 1 ; sh:maxCount 1 ] ;
+    sh:property [ sh:path ub:emailAddress ; sh:minCount 1 ] ;
+    sh:property [ sh:path ub:worksFor ; sh:minCount 1 ; sh:class ub:Department ] .
+
+ub:GraduateCourseShape a sh:NodeShape ;
+    sh:targetClass ub:GraduateCourse ;
+    sh:property [ sh:path ub:name ; sh:minCount 1 ; sh:maxCount 1 ] .
+
+ub:GraduateStudentShape a sh:NodeShape ;
+    sh:targetClass ub:GraduateStudent ;
+    sh:property [ sh:path ub:name ; sh:minCount 1 ; sh:maxCount 1 ] ;
+    sh:property [ sh:path ub:emailAddress ; sh:minCount 1 ] ;
+    sh:property [ sh:path ub:advisor ; sh:maxCount 1 ; sh:class ub:FullProfessor ] ;
+    sh:property [ sh:path ub:memberOf ; sh:minCount 1 ; sh:class ub:Department ] ;
+    sh:property [ sh:path ub:takesCourse ; sh:minCount 1 ; sh:class ub:GraduateCourse ] .
+'''
+
+
+# noise vocabulary: every alias is only reachable through the schema axiom in front of it
+SCHEMA = [
+    (UB + "advisor", RDF_TYPE, OWL_NS + "FunctionalProperty"),
+    (UB + "PhDStudent", OWL_NS + "equivalentClass", UB + "GraduateStudent"),
+    (UB + "Professor", OWL_NS + "equivalentClass", UB + "FullProfessor"),
+    (UB + "mbox", RDFS_NS + "subPropertyOf", UB + "emailAddress"),
+    (UB + "headOf", RDFS_NS + "subPropertyOf", UB + "worksFor"),
+    (UB + "enrolledIn", RDFS_NS + "subPropertyOf", UB + "takesCourse"),
+]
+
+
+def iri(x):
+    return "<%s>" % x
+
+
+def literal(x):
+    return '"%s"' % x
+
+
+def generate_lubm(universities=1, departments=5, professors=10, students=100, courses=20,
+                  same_as=0.0, equivalent_class=0.0, sub_property=0.0, functional=0.0, seed=0):
+    # LUBM-style N-Triples, every rate is the share of entities that gets that kind of noise
+    r = random.Random(seed)
+    lines = ["%s %s %s ." % tuple(iri(t) for t in triple) for triple in SCHEMA]
+
+    def add(s, p, o):
+        lines.append("%s %s %s ." % (s, iri(p), o))
+
+    def student_class():
+        return UB + ("PhDStudent" if r.random() < equivalent_class else "GraduateStudent")
+
+    def email_property():
+        return UB + ("mbox" if r.random() < sub_property else "emailAddress")
+
+    for u in range(universities):
+        univ = iri("http://www.University%d.edu" % u)
+        add(univ, RDF_TYPE, iri(UB + "University"))
+        add(univ, UB + "name", literal("University%d" % u))
+        for d in range(departments):
+            base = "http://www.Department%d.University%d.edu/" % (d, u)
+            dept = iri(base)
+            add(dept, RDF_TYPE, iri(UB + "Department"))
+            add(dept, UB + "name", literal("Department%d" % d))
+            add(dept, UB + "subOrganizationOf", univ)
+            course_iris = []
+            for c in range(courses):
+                course = iri(base + "GraduateCourse%d" % c)
+                course_iris.append(course)
+                add(course, RDF_TYPE, iri(UB + "GraduateCourse"))
+                add(course, UB + "name", literal("GraduateCourse%d" % c))
+            prof_iris = []
+            for p in range(professors):
+                prof = iri(base + "FullProfessor%d" % p)
+                prof_iris.append(prof)
+                cls = "Professor" if r.random() < equivalent_class else "FullProfessor"
+                add(prof, RDF_TYPE, iri(UB + cls))
+                add(prof, UB + "name", literal("FullProfessor%d" % p))
+                add(prof, email_property(), literal("FullProfessor%d@Department%d.University%d.edu" % (p, d, u)))
+                add(prof, UB + ("headOf" if p == 0 and r.random() < sub_property else "worksFor"), dept)
+            for s in range(students):
+                student = iri(base + "GraduateStudent%d" % s)
+                add(student, RDF_TYPE, iri(student_class()))
+                add(student, UB + "name", literal("GraduateStudent%d" % s))
+                add(student, email_property(), literal("GraduateStudent%d@Department%d.University%d.edu" % (s, d, u)))
+                add(student, UB + "memberOf", dept)
+                add(student, UB + "advisor", r.choice(prof_iris))
+                taking = UB + ("enrolledIn" if r.random() < sub_property else "takesCourse")
+                add(student, taking, r.choice(course_iris))
+                if r.random() < same_as:
+                    # a second description of the same student from another source
+                    alias = iri(base + "Student%d" % s)
+                    add(alias, OWL_NS + "sameAs", student)
+                    add(alias, UB + "takesCourse", r.choice(course_iris))
+                if r.random() < functional:
+                    # the advisor under another IRI, identified through ub:advisor being functional
+                    add(student, UB + "advisor", iri(base + "Advisor%d" % s))
+    return "\n".join(lines) + "\n"
+
+
+def run_naive(data_path, stats):
+    g = rdflib.Graph().parse(data_path, format="nt")
+    conforms, v_graph, v_text = validate(g, shacl_graph=shapes_graph, shacl_graph_format="turtle",
+                                         inference="both", inplace=True)
+    return g, conforms
+
+
+def run_fused(data_path, stats, **kwargs):
+    g, same_nodes = fused_graph(data_path, shacl_graph=shapes_graph, data_graph_format="nt",
+                                shacl_graph_format="turtle", stats=stats, **kwargs)
+    stats["fused_seconds"] = time.perf_counter() - stats["start"]
+    conforms, v_graph, v_text = validate(g, shacl_graph=shapes_graph, shacl_graph_format="turtle",
+                                         inference="none")
+    return g, conforms
+
+
+def run_noiseless(data_path, stats, merge_Type, **kwargs):
+    g, same_nodes = noiseless_fused_graph(data_path, shacl_graph=shapes_graph, data_graph_format="nt",
+                                          shacl_graph_format="turtle", merge_Type=merge_Type,
+                                          stats=stats, **kwargs)
+    stats["fused_seconds"] = time.perf_counter() - stats["start"]
+    conforms, v_graph, v_text = validate(g, shacl_graph=shapes_graph, shacl_graph_format="turtle",
+                                         inference="none")
+    return g, conforms
+
+
+def run_noiseless_remove(data_path, stats, **kwargs):
+    return run_noiseless(data_path, stats, True, **kwargs)
+
+
+def run_noiseless_add(data_path, stats, **kwargs):
+    return run_noiseless(data_path, stats, False, **kwargs)
+
+
+METHODS = {
+    "naive": run_naive,
+    "fused": run_fused,
+    "noiseless_remove": run_noiseless_remove,
+    "noiseless_add": run_noiseless_add,
+}
+
+
+def measure(method, data_path, options, results):
+    # runs in its own process, so ru_maxrss is the peak of this method alone
+    stats = {"start": time.perf_counter()}
+    kwargs = dict() if method == "naive" else options
+    try:
+        g, conforms = METHODS[method](data_path, stats, **kwargs)
+    except Exception as e:
+        results.put({"status": "error", "error": "%s: %s" % (type(e).__name__, e)})
+        return
+    seconds = time.perf_counter() - stats.pop("start")
+    stats.update({
+        "status": "ok",
+        "seconds": seconds,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "triples": len(g),
+        "conforms": conforms,
+    })
+    results.put(stats)
+
+
+def run_benchmark(data_path, method, options, timeout=None):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure, args=(method, data_path, options, results))
+    process.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=0.5)
+        except queue.Empty:
+            if not process.is_alive():
+                result = {"status": "error", "error": "exit code %s" % process.exitcode}
+            elif deadline is not None and time.monotonic() > deadline:
+                result = {"status": "timeout"}
+    process.join(1)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+    return result
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LUBM scaling benchmark: fused graphs against inference='both'")
+    parser.add_argument("--universities", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--departments", type=int, default=5)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--same-as", type=float, default=0.05)
+    parser.add_argument("--equivalent-class", type=float, default=0.05)
+    parser.add_argument("--sub-property", type=float, default=0.05)
+    parser.add_argument("--functional", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--methods", nargs="+", choices=sorted(METHODS), default=sorted(METHODS))
+    parser.add_argument("--backend", default="rdflib")
+    parser.add_argument("--semi-naive", action="store_true")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds per method and size")
+    parser.add_argument("--data-dir", default="benchmark_data")
+    parser.add_argument("--output", default="benchmark_results.jsonl")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    noise = {
+        "same_as": args.same_as,
+        "equivalent_class": args.equivalent_class,
+        "sub_property": args.sub_property,
+        "functional": args.functional,
+    }
+    options = {"backend": args.backend, "semi_naive": args.semi_naive}
+    rev = revision()
+    for universities in args.universities:
+        data_path = os.path.join(args.data_dir, "lubm-u%d-d%d-s%d-seed%d.nt" % (
+            universities, args.departments, args.students, args.seed))
+        data = generate_lubm(universities, departments=args.departments, students=args.students,
+                             seed=args.seed, **noise)
+        with open(data_path, "w") as f:
+            f.write(data)
+        input_triples = data.count("\n")
+        for method in args.methods:
+            result = run_benchmark(data_path, method, options, args.timeout)
+            record = {
+                "revision": rev,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "method": method,
+                "universities": universities,
+                "departments": args.departments,
+                "students": args.students,
+                "seed": args.seed,
+                "noise": noise,
+                "options": options if method != "naive" else None,
+                "input_triples": input_triples,
+            }
+            record.update(result)
+            with open(args.output, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            print(method, universities, result.get("status"), result.get("seconds"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import math
+
+
+class BloomFilter:
+    # Set membership with false positives but no false negatives: a miss
+    # means the item was never added. A full layer is kept and a new one of
+    # twice the capacity is started (scalable Bloom filter), so the error
+    # rate stays bounded without knowing the number of items up front.
+    # Items cannot be removed, a removed item only stays a false positive.
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.error_rate = error_rate
+        self.layers = []
+        self.count = 0
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        # every layer gets half the error rate of the one before
+        rate = self.error_rate * 0.5 ** (len(self.layers) + 1)
+        bits = max(64, int(-capacity * math.log(rate) / math.log(2) ** 2))
+        probes = max(1, round(bits / capacity * math.log(2)))
+        self.layers.append((bytearray((bits + 7) // 8), bits, probes, capacity))
+        self.count = 0
+
+    def add(self, item):
+        array, bits, probes, capacity = self.layers[-1]
+        if self.count >= capacity:
+            self.grow(capacity * 2)
+            array, bits, probes, capacity = self.layers[-1]
+        # double hashing, bit i is h1 + i * h2
+        h = hash(item)
+        i = h % bits
+        step = ((h >> 32) | 1) % bits
+        for n in range(probes):
+            array[i >> 3] |= 1 << (i & 7)
+            i = (i + step) % bits
+        self.count += 1
+
+    def __contains__(self, item):
+        h = hash(item)
+        for array, bits, probes, capacity in self.layers:
+            i = h % bits
+            step = ((h >> 32) | 1) % bits
+            for n in range(probes):
+                if not array[i >> 3] & (1 << (i & 7)):
+                    break
+                i = (i + step) % bits
+            else:
+                return True
+        return False
@@ -0,0 +1,90 @@
+class TransitiveClosure:
+    # Reachability over the edges of one property. Strongly connected
+    # components are condensed first (iterative Tarjan), reachable sets are
+    # then computed once per component of the condensed DAG, on demand.
+
+    def __init__(self, edges):
+        self.successors = dict()
+        for s, o in edges:
+            self.successors.setdefault(s, []).append(o)
+            self.successors.setdefault(o, [])
+        self.component = dict()
+        self.members = []
+        self.condensed = []
+        self.reach = dict()
+        self.condense()
+
+    def condense(self):
+        index = dict()
+        low = dict()
+        stack = []
+        on_stack = set()
+        for root in self.successors:
+            if root in index:
+                continue
+            work = [(root, iter(self.successors[root]))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while len(work) != 0:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self.successors[child])))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if len(work) != 0:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        c = len(self.members)
+                        members = []
+                        while True:
+                            x = stack.pop()
+                            on_stack.discard(x)
+                            self.component[x] = c
+                            members.append(x)
+                            if x == node:
+                                break
+                        self.members.append(members)
+        for c, members in enumerate(self.members):
+            self.condensed.append(set(
+                self.component[o] for x in members for o in self.successors[x]
+                if self.component[o] != c))
+
+    def reachable_components(self, c):
+        work = [c]
+        while len(work) != 0:
+            d = work[-1]
+            if d in self.reach:
+                work.pop()
+                continue
+            missing = [e for e in self.condensed[d] if e not in self.reach]
+            if len(missing) != 0:
+                work.extend(missing)
+                continue
+            reach = {d}
+            for e in self.condensed[d]:
+                reach |= self.reach[e]
+            self.reach[d] = frozenset(reach)
+            work.pop()
+        return self.reach[c]
+
+    def reachable(self, x):
+        # x itself included, like Graph.transitive_objects
+        if x not in self.component:
+            return [x]
+        return [y for c in self.reachable_components(self.component[x]) for y in self.members[c]]
+
+    def reaches(self, x, y):
+        if x == y:
+            return True
+        if x not in self.component or y not in self.component:
+            return False
+        return self.component[y] in self.reachable_components(self.component[x])
@@ -0,0 +1,153 @@
+from rdflib.namespace import OWL, RDF
+
+from errors import FusionRuntimeError
+from profiling import rule
+
+
+def violation(violations, message):
+    # raises, or records the error and lets the fusion go on when a list is given
+    error = FusionRuntimeError(message)
+    if violations is None:
+        raise error
+    violations.append(error)
+
+
+class ConsistencyChecks:
+    # Batched cls-com, cax-dw, prp-irp, prp-asyp and prp-pdw, run once per
+    # fixpoint round. A class or property is checked against the whole
+    # graph the first time it is seen or when one of its axioms changed,
+    # afterwards only the nodes touched since the last round are joined
+    # against it. A touched class is usually the object of new rdf:type
+    # triples, whose subjects are touched too, so it is only rechecked when
+    # its complementOf / disjointWith axioms differ from the last check.
+
+    def __init__(self, violations=None):
+        self.violations = violations
+        self.reported = set()
+        self.classes = set()
+        self.properties = set()
+        self.class_axioms = dict() # class -> its axioms when it was last checked
+
+    def changed_classes(self, g, classes):
+        changed = set()
+        for c in classes:
+            axioms = class_axioms(g, c)
+            if self.class_axioms.get(c) != axioms:
+                self.class_axioms[c] = axioms
+                changed.add(c)
+        return changed
+
+    def run(self, g, classes, properties, nodes):
+        found = None if self.violations is None else []
+        new_classes = set(classes) - self.classes
+        self.changed_classes(g, new_classes)
+        new_classes.update(self.changed_classes(g, self.classes.intersection(nodes)))
+        new_properties = set(properties) - self.properties
+        new_properties.update(self.properties.intersection(nodes))
+        for check in (check_complementOf_batch, check_disjointWith_batch):
+            check(g, new_classes, None, found)
+            if len(nodes) != 0:
+                check(g, self.classes - new_classes, nodes, found)
+        for check in (check_irreflexive_batch, check_asymmetric_batch, check_propertyDisjointWith_batch):
+            check(g, new_properties, None, found)
+            if len(nodes) != 0:
+                check(g, self.properties - new_properties, nodes, found)
+        self.classes.update(new_classes)
+        self.properties.update(new_properties)
+        if found is not None:
+            # a rechecked class or property finds its old violations again
+            for error in found:
+                if error.message not in self.reported:
+                    self.reported.add(error.message)
+                    self.violations.append(error)
+
+
+def class_pairs(g, classes, predicate):
+    # (c1, c2) for every c1 predicate c2 axiom with a tracked class on either side
+    pairs = set()
+    for c in classes:
+        for c2 in g.objects(c, predicate):
+            pairs.add((c, c2))
+        for c1 in g.subjects(predicate, c):
+            pairs.add((c1, c))
+    return pairs
+
+
+def class_axioms(g, c):
+    axioms = set()
+    for predicate in (OWL.complementOf, OWL.disjointWith):
+        axioms.update((predicate, c1, c2) for c1, c2 in class_pairs(g, (c,), predicate))
+    return frozenset(axioms)
+
+
+def class_clashes(g, classes, predicate, nodes):
+    pairs = class_pairs(g, classes, predicate)
+    if len(pairs) == 0:
+        return
+    if nodes is None:
+        # hash join of the instances of both classes
+        for c1, c2 in pairs:
+            instances = set(g.subjects(RDF.type, c1))
+            for x in g.subjects(RDF.type, c2):
+                if x in instances:
+                    yield c1, c2, x
+    else:
+        partners = dict()
+        for c1, c2 in pairs:
+            partners.setdefault(c1, set()).add(c2)
+        for x in nodes:
+            types = set(g.objects(x, RDF.type))
+            for c1 in types.intersection(partners):
+                for c2 in partners[c1].intersection(types):
+                    yield c1, c2, x
+
+
+@rule("cls-com")
+def check_complementOf_batch(g, classes, nodes=None, violations=None):
+    for c1, c2, x in class_clashes(g, classes, OWL.complementOf, nodes):
+        violation(violations,
+                  "Violation of complementarity for classes %s and %s on element %s (or an identical individual with it)"
+                  % (c1, c2, x))
+
+
+@rule("cax-dw")
+def check_disjointWith_batch(g, classes, nodes=None, violations=None):
+    for c1, c2, x in class_clashes(g, classes, OWL.disjointWith, nodes):
+        violation(violations,
+                  "Disjoint classes %s and %s have a common individual %s (or an identical individual with it)"
+                  % (c1, c2, x))
+
+
+def edges(g, p, nodes):
+    # the (x, y) edges of p, all of them or only those leaving nodes
+    if nodes is None:
+        return g.subject_objects(p)
+    return ((x, y) for x in nodes for y in g.objects(x, p))
+
+
+@rule("prp-irp")
+def check_irreflexive_batch(g, properties, nodes=None, violations=None):
+    for p in properties:
+        if (p, RDF.type, OWL.IrreflexiveProperty) in g:
+            for x, y in edges(g, p, nodes):
+                if x == y:
+                    violation(violations, "Irreflexive property used on %s with %s" % (x, p))
+
+
+@rule("prp-asyp")
+def check_asymmetric_batch(g, properties, nodes=None, violations=None):
+    for p in properties:
+        if (p, RDF.type, OWL.AsymmetricProperty) in g:
+            for x, y in edges(g, p, nodes):
+                if (y, p, x) in g:
+                    violation(violations, "Erroneous usage of asymmetric property %s on %s and %s" % (p, x, y))
+
+
+@rule("prp-pdw")
+def check_propertyDisjointWith_batch(g, properties, nodes=None, violations=None):
+    for p in properties:
+        for p2 in g.objects(p, OWL.propertyDisjointWith):
+            for x, y in edges(g, p, nodes):
+                if (x, p2, y) in g:
+                    violation(violations,
+                              "Erroneous usage of disjoint properties %s and %s on %s and %s" % (p, p2, x, y))
@@ -0,0 +1,247 @@
+import random
+
+import rdflib
+from rdflib import Literal
+from rdflib.compare import isomorphic
+from rdflib.namespace import OWL, RDF, RDFS
+from pyshacl import validate
+
+from fused_graph import FusedGraph, fuse_and_validate, fused_graph, sharded_fused_graph
+
+# Fuses generated data graphs with fused_graph and checks that the other ways
+# of computing it give the same graph and the same focus nodes: semi_naive,
+# the numpy backend, a SQLite store, a FusedGraph built in one go and
+# sharded_fused_graph. fuse_and_validate has to report what pyshacl reports
+# on the fused graph. A FusedGraph updated with add() or remove() is only
+# checked for what FusedGraph guarantees. Run with pytest.
+
+EX = rdflib.Namespace("http://example.org/")
+
+shapes_graph = '''
+@prefix ex: <http://example.org/> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+
+ex:Shape
+    a sh:NodeShape ;
+    sh:targetClass ex:C0 ;
+    sh:property [ sh:path ex:p0 ] ;
+    sh:property [ sh:path ex:p1 ] .
+'''
+
+CHARACTERISTICS = (OWL.FunctionalProperty, OWL.InverseFunctionalProperty, OWL.SymmetricProperty,
+                   OWL.TransitiveProperty)
+
+
+def generate(r, size):
+    # a small random graph over 4 classes, 4 properties and 8 nodes; the
+    # subproperty and equivalent property axioms cannot form a cycle
+    classes = [EX["C%d" % i] for i in range(4)]
+    properties = [EX["p%d" % i] for i in range(4)]
+    nodes = [EX["n%d" % i] for i in range(8)]
+    g = rdflib.Graph()
+    g.bind("ex", EX)
+    for i in range(size):
+        k = r.random()
+        if k < 0.25:
+            g.add((r.choice(nodes), RDF.type, r.choice(classes)))
+        elif k < 0.35:
+            g.add((r.choice(nodes), OWL.sameAs, r.choice(nodes)))
+        elif k < 0.42:
+            g.add((r.choice(classes), OWL.equivalentClass, r.choice(classes)))
+        elif k < 0.47:
+            g.add((r.choice(properties[2:]), OWL.equivalentProperty, r.choice(properties[2:])))
+        elif k < 0.52:
+            g.add((r.choice(properties[:2]), RDFS.subPropertyOf, r.choice(properties[2:])))
+        elif k < 0.57:
+            g.add((r.choice(properties), RDF.type, r.choice(CHARACTERISTICS)))
+        elif k < 0.62:
+            g.add((r.choice(properties), r.choice((RDFS.domain, RDFS.range)), r.choice(classes)))
+        elif k < 0.9:
+            g.add((r.choice(nodes), r.choice(properties), r.choice(nodes)))
+        else:
+            g.add((r.choice(nodes), r.choice(properties), Literal(r.randrange(3))))
+    return g
+
+
+def normalized(g, same_nodes):
+    # the graph with every alias replaced by the smallest member of its
+    # group, and the groups; which member is the focus node does not matter
+    groups = []
+    rename = dict()
+    for focus, aliases in same_nodes.items():
+        group = sorted([focus] + list(aliases))
+        groups.append(group)
+        for x in group:
+            rename[x] = group[0]
+    ng = rdflib.Graph()
+    for triple in g:
+        ng.add(tuple(rename.get(x, x) for x in triple))
+    return ng, sorted(groups)
+
+
+def outcome(fuse):
+    try:
+        return normalized(*fuse())
+    except Exception as e:
+        return type(e).__name__
+
+
+def same_outcome(a, b):
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return a[1] == b[1] and isomorphic(a[0], b[0])
+
+
+def turtle(triples):
+    g = rdflib.Graph()
+    g.bind("ex", EX)
+    for t in triples:
+        g.add(t)
+    return g.serialize(format="turtle")
+
+
+def fused_graph_by(data, **kwargs):
+    return fused_graph(data, shacl_graph=shapes_graph, data_graph_format="turtle", shacl_graph_format="turtle",
+                       **kwargs)
+
+
+def fused_graph_class(data):
+    return FusedGraph(data, shacl_graph=shapes_graph, data_graph_format="turtle", shacl_graph_format="turtle")
+
+
+def incremental(data):
+    fg = fused_graph_class(data)
+    return fg.graph, fg.same_nodes
+
+
+def sharded(data):
+    return sharded_fused_graph(data, shacl_graph=shapes_graph, data_graph_format="turtle",
+                               shacl_graph_format="turtle", workers=2)
+
+
+def is_instance_triple(triple):
+    s, p, o = triple
+    if p == RDF.type:
+        return o not in CHARACTERISTICS
+    return p not in (OWL.equivalentClass, OWL.equivalentProperty, RDFS.subPropertyOf, RDFS.domain, RDFS.range)
+
+
+# every generated graph is fused by every way, a fixed seed per test
+SEEDS = (0, 1, 2)
+GRAPHS = 40
+SIZE = 20
+
+
+def generated(seed, graphs):
+    r = random.Random(seed)
+    for i in range(graphs):
+        triples = sorted(generate(r, SIZE))
+        yield r, triples, turtle(triples)
+
+
+def check_same(fuse, seed, graphs=GRAPHS):
+    for r, triples, data in generated(seed, graphs):
+        expected = outcome(lambda: fused_graph_by(data))
+        assert same_outcome(expected, outcome(lambda: fuse(data))), data
+
+
+def test_semi_naive():
+    for seed in SEEDS:
+        check_same(lambda data: fused_graph_by(data, semi_naive=True), seed)
+
+
+def test_numpy():
+    for seed in SEEDS:
+        check_same(lambda data: fused_graph_by(data, backend="numpy"), seed)
+
+
+def test_store():
+    for seed in SEEDS:
+        check_same(lambda data: fused_graph_by(data, store=":memory:"), seed)
+
+
+def test_fused_graph_class():
+    for seed in SEEDS:
+        check_same(lambda data: incremental(data), seed)
+
+
+def test_sharded_fused_graph():
+    # starts worker processes, one seed is enough
+    check_same(sharded, SEEDS[0], graphs=10)
+
+
+# the axioms fusion consumes, FusedGraph does not keep them in the graph
+CONSUMED = (OWL.sameAs, OWL.equivalentClass, OWL.equivalentProperty, RDFS.subPropertyOf)
+
+
+def updated(seed):
+    # a FusedGraph grown with add() and one shrunk with remove() by a quarter
+    # of the instance triples of every generated graph
+    for r, triples, data in generated(seed, GRAPHS):
+        instances = [t for t in triples if is_instance_triple(t)]
+        if len(instances) == 0 or isinstance(outcome(lambda: fused_graph_by(data)), str):
+            continue
+        chosen = r.sample(instances, max(1, len(instances) // 4))
+        rest = [t for t in triples if t not in chosen]
+
+        fg = fused_graph_class(turtle(rest))
+        fg.add(chosen)
+        assert set(fg.asserted) == set(triples)
+        yield data, fg
+
+        fg = fused_graph_class(data)
+        fg.remove(chosen)
+        assert set(fg.asserted) == set(rest)
+        yield data, fg
+
+
+def test_fused_graph_update_keeps_asserted_triples():
+    for seed in SEEDS:
+        for data, fg in updated(seed):
+            for triple in fg.asserted:
+                if triple[1] not in CONSUMED:
+                    assert fg._canonical(triple) in fg.graph, data
+
+
+def test_fused_graph_update_leaves_no_alias():
+    for seed in SEEDS:
+        for data, fg in updated(seed):
+            aliases = set(a for members in fg.same_nodes.values() for a in members)
+            assert all(x not in aliases for triple in fg.graph for x in triple), data
+
+
+def test_fused_graph_refuse():
+    for seed in SEEDS:
+        for data, fg in updated(seed):
+            expected = outcome(lambda: fused_graph_by(turtle(fg.asserted)))
+            assert same_outcome(expected, outcome(lambda: (fg.refuse().graph, fg.same_nodes))), data
+
+
+# the shapes of the generated graphs with constraints, for the reports
+constrained_shapes_graph = '''
+@prefix ex: <http://example.org/> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+
+ex:Shape
+    a sh:NodeShape ;
+    sh:targetClass ex:C0 ;
+    sh:property [ sh:path ex:p0 ; sh:maxCount 1 ; sh:nodeKind sh:IRI ] ;
+    sh:property [ sh:path ex:p1 ; sh:class ex:C1 ] .
+'''
+
+
+def test_fuse_and_validate():
+    for options in (None, {"advanced": True}, {"debug": True}):
+        for r, triples, data in generated(SEEDS[0], 10):
+            try:
+                fused, same_nodes = fused_graph(data, shacl_graph=constrained_shapes_graph,
+                                                data_graph_format="turtle", shacl_graph_format="turtle")
+            except Exception:
+                continue
+            expected = validate(fused, shacl_graph=constrained_shapes_graph, shacl_graph_format="turtle",
+                                inference="none", **(options or {}))
+            conforms, report_graph, report_text, same_nodes, timings = fuse_and_validate(
+                data, shacl_graph=constrained_shapes_graph, data_graph_format="turtle",
+                shacl_graph_format="turtle", validation_options=options)
+            assert conforms == expected[0], data
+            assert isomorphic(report_graph, expected[1]), data
@@ -0,0 +1,618 @@
+from itertools import chain
+
+import numpy as np
+
+from rdflib import BNode, Literal
+from rdflib.namespace import OWL, RDF, RDFS
+
+from errors import FusionRuntimeError
+import profiling
+from profiling import rule
+
+EMPTY = np.zeros(0, dtype=np.int64)
+
+VOCABULARY = (
+    RDF.type,
+    RDFS.subClassOf,
+    RDFS.subPropertyOf,
+    RDFS.domain,
+    RDFS.range,
+    OWL.sameAs,
+    OWL.differentFrom,
+    OWL.equivalentClass,
+    OWL.equivalentProperty,
+    OWL.inverseOf,
+    OWL.propertyDisjointWith,
+    OWL.complementOf,
+    OWL.disjointWith,
+    OWL.FunctionalProperty,
+    OWL.InverseFunctionalProperty,
+    OWL.SymmetricProperty,
+    OWL.AsymmetricProperty,
+    OWL.TransitiveProperty,
+    OWL.IrreflexiveProperty,
+)
+
+
+class TermDictionary:
+
+    def __init__(self):
+        self.ids = dict()
+        self.terms = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def encode(self, term):
+        i = self.ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            self.ids[term] = i
+            self.terms.append(term)
+        return i
+
+    def decode(self, i):
+        return self.terms[i]
+
+
+class EncodedGraph:
+    # Dictionary-encoded triples. Every predicate keeps a sorted, duplicate
+    # free int64 array of s * n + o keys, so a predicate lookup is a dict
+    # access and (s, p) / (s, p, o) lookups are binary searches.
+
+    def __init__(self, graph, terms, extra_terms=()):
+        self.terms = terms
+        for t in extra_terms:
+            terms.encode(t)
+        rows = dict()
+        for s, p, o in graph:
+            rows.setdefault(terms.encode(p), []).append((terms.encode(s), terms.encode(o)))
+        self.n = len(terms)
+        self.keys = dict()
+        for p, so in rows.items():
+            a = np.array(so, dtype=np.int64)
+            self.keys[p] = np.unique(a[:, 0] * self.n + a[:, 1])
+        self.initial = dict(self.keys)
+        # real changes, read by the profiler
+        self.additions = 0
+        self.removals = 0
+        self.literal = np.array([isinstance(t, Literal) for t in terms.terms], dtype=bool)
+
+    def __len__(self):
+        return sum(len(k) for k in self.keys.values())
+
+    def id(self, term):
+        return self.terms.ids[term]
+
+    def pairs(self, p):
+        k = self.keys.get(p, EMPTY)
+        return k // self.n, k % self.n
+
+    def objects(self, s, p):
+        k = self.keys.get(p, EMPTY)
+        lo = np.searchsorted(k, s * self.n)
+        hi = np.searchsorted(k, (s + 1) * self.n)
+        return k[lo:hi] % self.n
+
+    def subjects(self, p, o):
+        s, oo = self.pairs(p)
+        return s[oo == o]
+
+    def contains(self, s, p, o):
+        k = self.keys.get(p, EMPTY)
+        key = s * self.n + o
+        i = np.searchsorted(k, key)
+        return bool(i < len(k) and k[i] == key)
+
+    def add(self, p, s, o):
+        new = np.unique(np.atleast_1d(np.asarray(s, dtype=np.int64) * self.n + np.asarray(o, dtype=np.int64)))
+        old = self.keys.get(p, EMPTY)
+        fresh = np.setdiff1d(new, old, assume_unique=True)
+        if len(fresh) != 0:
+            self.keys[p] = np.union1d(old, fresh)
+            self.additions += len(fresh)
+        return len(fresh)
+
+    def remove(self, p, s, o):
+        old = self.keys.get(p)
+        if old is None:
+            return 0
+        gone = np.atleast_1d(np.asarray(s, dtype=np.int64) * self.n + np.asarray(o, dtype=np.int64))
+        kept = old[~np.isin(old, gone)]
+        if len(kept) == 0:
+            del self.keys[p]
+        else:
+            self.keys[p] = kept
+        self.removals += len(old) - len(kept)
+        return len(old) - len(kept)
+
+    def rewrite(self, rep, touched):
+        # eq-rep-s, eq-rep-o: replace subjects and objects through rep
+        same_as = self.id(OWL.sameAs)
+        for p in list(self.keys):
+            k = self.keys[p]
+            s = k // self.n
+            o = k % self.n
+            hit = touched[s] | touched[o]
+            if not hit.any():
+                continue
+            ns = rep[s[hit]]
+            no = rep[o[hit]]
+            if p == same_as:
+                keep = ns != no
+                ns = ns[keep]
+                no = no[keep]
+            self.replace(p, np.union1d(k[~hit], ns * self.n + no))
+
+    def move_term(self, old, new, keep=False):
+        # eq-rep-s, eq-rep-o, eq-rep-p for a single (property) term
+        for p in list(self.keys):
+            k = self.keys[p]
+            s = k // self.n
+            o = k % self.n
+            hit = (s == old) | (o == old)
+            if not hit.any():
+                continue
+            ns = np.where(s[hit] == old, new, s[hit])
+            no = np.where(o[hit] == old, new, o[hit])
+            if not keep:
+                k = k[~hit]
+            self.replace(p, np.union1d(k, ns * self.n + no))
+        if old in self.keys:
+            self.replace(new, np.union1d(self.keys.get(new, EMPTY), self.keys[old]))
+            if not keep:
+                self.replace(old, EMPTY)
+
+    def replace(self, p, k):
+        # new keys for p, counting the triples that really changed
+        old = self.keys.get(p, EMPTY)
+        kept = len(np.intersect1d(old, k, assume_unique=True))
+        self.additions += len(k) - kept
+        self.removals += len(old) - kept
+        if len(k) == 0:
+            self.keys.pop(p, None)
+        else:
+            self.keys[p] = k
+
+    def decode_into(self, graph):
+        # only the difference to the encoded input goes back through rdflib
+        terms = self.terms.terms
+        for p in set(self.initial).union(self.keys):
+            before = self.initial.get(p, EMPTY)
+            after = self.keys.get(p, EMPTY)
+            for key in np.setdiff1d(before, after, assume_unique=True).tolist():
+                graph.remove((terms[key // self.n], terms[p], terms[key % self.n]))
+            added = np.setdiff1d(after, before, assume_unique=True)
+            graph.addN(
+                (terms[s], terms[p], terms[o], graph)
+                for s, o in zip((added // self.n).tolist(), (added % self.n).tolist())
+            )
+        return graph
+
+
+def compose(s1, o1, s2, o2):
+    # (a, b) in 1 and (b, c) in 2 --> (a, c)
+    order = np.argsort(s2, kind="stable")
+    s2 = s2[order]
+    o2 = o2[order]
+    lo = np.searchsorted(s2, o1, "left")
+    hi = np.searchsorted(s2, o1, "right")
+    count = hi - lo
+    total = int(count.sum())
+    if total == 0:
+        return EMPTY, EMPTY
+    a = np.repeat(s1, count)
+    idx = np.repeat(lo, count) + np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+    return a, o2[idx]
+
+
+def components(n, a, b):
+    # label propagation with pointer jumping, labels are the smallest index of a component
+    label = np.arange(n)
+    while True:
+        before = label.copy()
+        m = np.minimum(label[a], label[b])
+        np.minimum.at(label, a, m)
+        np.minimum.at(label, b, m)
+        label = label[label]
+        if np.array_equal(before, label):
+            return label
+
+
+class EncodedState:
+
+    def __init__(self, eg, found_node_targets, same_nodes, target_classes, path_value):
+        self.is_target = np.zeros(eg.n, dtype=bool)
+        self.is_target[[eg.id(f) for f in found_node_targets]] = True
+        self.same = dict()
+        for f, same_set in same_nodes.items():
+            self.same[eg.id(f)] = set(eg.id(o) for o in same_set)
+        self.classes = set(eg.id(c) for c in target_classes)
+        self.paths = [eg.id(p) for p in path_value]
+
+    def add_targets(self, ids):
+        ids = np.unique(np.atleast_1d(ids))
+        new = ids[~self.is_target[ids]]
+        self.is_target[new] = True
+        for x in new.tolist():
+            self.same[x] = set()
+
+
+def instances_by_class(eg):
+    s, o = eg.pairs(eg.id(RDF.type))
+    order = np.argsort(o, kind="stable")
+    return s[order], o[order]
+
+
+def instances(index, c):
+    s, o = index
+    return s[np.searchsorted(o, c, "left"):np.searchsorted(o, c, "right")]
+
+
+@rule("cax-dw/cls-com")
+def check_com_dw(eg, class_list):
+    index = instances_by_class(eg)
+    term = eg.terms.decode
+    for target_class in class_list:
+        for pred, message in ((OWL.complementOf,
+                               "Violation of complementarity for classes %s and %s on element %s (or an identical individual with it)"),
+                              (OWL.disjointWith,
+                               "Disjoint classes %s and %s have a common individual %s (or an identical individual with it)")):
+            pred = eg.id(pred)
+            for c2 in eg.objects(target_class, pred).tolist(): # RULE cls-com, cax-dw
+                common = np.intersect1d(instances(index, target_class), instances(index, c2))
+                if len(common) != 0:
+                    raise FusionRuntimeError(message % (term(target_class), term(c2), term(common[0])))
+            for c1 in eg.subjects(pred, target_class).tolist():
+                common = np.intersect1d(instances(index, c1), instances(index, target_class))
+                if len(common) != 0:
+                    raise FusionRuntimeError(message % (term(c1), term(target_class), term(common[0])))
+
+
+@rule("prp-irp")
+def check_irreflexiveProperty(eg, p): # RULE prp-irp
+    if eg.contains(p, eg.id(RDF.type), eg.id(OWL.IrreflexiveProperty)):
+        s, o = eg.pairs(p)
+        hit = s == o
+        if hit.any():
+            raise FusionRuntimeError(
+                "Irreflexive property used on %s with %s" % (eg.terms.decode(s[hit][0]), eg.terms.decode(p)))
+
+
+@rule("prp-asyp")
+def check_asymmetricProperty(eg, p): # prp-asyp
+    if eg.contains(p, eg.id(RDF.type), eg.id(OWL.AsymmetricProperty)):
+        s, o = eg.pairs(p)
+        hit = np.isin(o * eg.n + s, eg.keys.get(p, EMPTY))
+        if hit.any():
+            raise FusionRuntimeError(
+                "Erroneous usage of asymmetric property %s on %s and %s"
+                % (eg.terms.decode(p), eg.terms.decode(s[hit][0]), eg.terms.decode(o[hit][0])))
+
+
+@rule("prp-pdw")
+def check_propertyDisjointWith(eg, focus_property): # prp-pdw
+    for p in eg.objects(focus_property, eg.id(OWL.propertyDisjointWith)).tolist():
+        common = np.intersect1d(eg.keys.get(focus_property, EMPTY), eg.keys.get(p, EMPTY))
+        if len(common) != 0:
+            raise FusionRuntimeError(
+                "Erroneous usage of disjoint properties %s and %s on %s and %s"
+                % (eg.terms.decode(focus_property), eg.terms.decode(p),
+                   eg.terms.decode(common[0] // eg.n), eg.terms.decode(common[0] % eg.n)))
+
+
+@rule("prp-symp")
+def check_symmetricProperty(eg, p): # RULE prp-symp
+    if eg.contains(p, eg.id(RDF.type), eg.id(OWL.SymmetricProperty)):
+        s, o = eg.pairs(p)
+        eg.add(p, o, s)
+
+
+@rule("prp-trp")
+def check_transitiveProperty(eg, p): # prp-trp
+    if eg.contains(p, eg.id(RDF.type), eg.id(OWL.TransitiveProperty)):
+        s, o = eg.pairs(p)
+        eg.add(p, s, s)
+        ds, do = s, o
+        while len(ds) != 0:
+            ns, no = compose(ds, do, s, o)
+            before = eg.keys.get(p, EMPTY)
+            eg.add(p, ns, no)
+            fresh = np.setdiff1d(eg.keys[p], before, assume_unique=True)
+            ds, do = fresh // eg.n, fresh % eg.n
+
+
+@rule("prp-inv")
+def check_inverseOf(eg, focus_property):
+    inverse = eg.id(OWL.inverseOf)
+    for p1 in chain(eg.subjects(inverse, focus_property).tolist(), eg.objects(focus_property, inverse).tolist()):
+        x, y = eg.pairs(p1)
+        eg.add(focus_property, y, x)
+        xx, yy = eg.pairs(focus_property)
+        eg.add(p1, yy, xx)
+
+
+@rule("prp-dom/rng")
+def check_domain_range(eg, p, state):
+    type_ = eg.id(RDF.type)
+    for c in eg.objects(p, eg.id(RDFS.domain)).tolist(): # RULE prp-dom
+        x, y = eg.pairs(p)
+        eg.add(type_, x, c)
+        if c in state.classes:
+            state.add_targets(x)
+    for c in eg.objects(p, eg.id(RDFS.range)).tolist(): # RULE prp-rng
+        x, y = eg.pairs(p)
+        eg.add(type_, y, c)
+        if c in state.classes:
+            state.add_targets(y)
+
+
+@rule("prp-fp")
+def check_FunctionalProperty(eg, focus_property): # prp-fp
+    if eg.contains(focus_property, eg.id(RDF.type), eg.id(OWL.FunctionalProperty)):
+        x, y = eg.pairs(focus_property)
+        add_same_stars(eg, x, y)
+
+
+@rule("prp-ifp")
+def check_InverseFunctionalProperty(eg, focus_property): # prp-ifp
+    if eg.contains(focus_property, eg.id(RDF.type), eg.id(OWL.InverseFunctionalProperty)):
+        x, y = eg.pairs(focus_property)
+        add_same_stars(eg, y, x)
+
+
+def add_same_stars(eg, key, member):
+    # members sharing a key get one sameAs each to the smallest of them in
+    # node_order, the same representative the rdflib rule picks
+    keys, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+    shared = counts[inverse] > 1
+    key = key[shared]
+    member = member[shared]
+    if len(key) == 0:
+        return
+    nodes = np.unique(member)
+    order = sorted(range(len(nodes)), key=lambda i: node_order(eg.terms.decode(nodes[i])))
+    rank = np.empty(len(nodes), dtype=np.int64)
+    rank[order] = np.arange(len(nodes))
+    member_rank = rank[np.searchsorted(nodes, member)]
+    order = np.lexsort((member_rank, key))
+    key = key[order]
+    member = member[order]
+    first = np.ones(len(key), dtype=bool)
+    first[1:] = key[1:] != key[:-1]
+    representative = member[first][np.cumsum(first) - 1]
+    keep = member != representative
+    eg.add(eg.id(OWL.sameAs), member[keep], representative[keep])
+
+
+def node_order(n):
+    # IRIs before blank nodes, then lexically
+    return (isinstance(n, BNode), str(n))
+
+
+def class_partners(eg, c):
+    eq_class = eg.id(OWL.equivalentClass)
+    same_as = eg.id(OWL.sameAs)
+    for c1 in eg.subjects(eq_class, c).tolist():
+        yield c1, (c1, eq_class, c)
+    for c2 in eg.objects(c, eq_class).tolist():
+        yield c2, (c, eq_class, c2)
+    for c1 in eg.subjects(same_as, c).tolist():
+        yield c1, (c1, same_as, c)
+    for c2 in eg.objects(c, same_as).tolist():
+        yield c2, (c, same_as, c2)
+
+
+@rule("cax-eqc")
+def merge_target_classes(eg, state):
+    type_ = eg.id(RDF.type)
+    sub_class = eg.id(RDFS.subClassOf)
+    eq_classes = set()
+    eq_nodes = []
+    for c in list(state.classes):
+        partners = list(class_partners(eg, c))
+        while len(partners) != 0:
+            # the whole equivalence group of c at once, as the rdflib rule
+            members = sorted(set(c1 for c1, axiom in partners))
+            index = instances_by_class(eg)
+            inst = np.unique(np.concatenate([instances(index, c1) for c1 in [c] + members]))
+            eq_classes.update(members)
+            eq_nodes.append(inst)
+            for c1 in [c] + members:
+                eg.add(type_, inst, c1)
+            for c1, (s, p, o) in partners:
+                eg.remove(p, s, o)
+            members = np.array(members, dtype=np.int64)
+            eg.add(sub_class, members, c)
+            eg.add(sub_class, c, members)
+            partners = list(class_partners(eg, c))
+    if len(eq_nodes) != 0:
+        state.add_targets(np.concatenate(eq_nodes))
+    state.classes.update(eq_classes)
+
+
+@rule("prp-dom/rng")
+def target_domain_range(eg, state):
+    type_ = eg.id(RDF.type)
+    for c in list(state.classes):
+        for p in eg.subjects(eg.id(RDFS.domain), c).tolist():
+            s, o = eg.pairs(p)
+            eg.add(type_, s, c)
+            state.add_targets(s)
+
+
+@rule()
+def all_targetClasses_merged(eg, state):
+    for c in state.classes:
+        for _ in class_partners(eg, c):
+            return False
+    return True
+
+
+@rule()
+def all_samePath_merged(eg, state):
+    for p in state.paths:
+        if not all_property_merged(eg, p) or len(eg.subjects(eg.id(RDFS.subPropertyOf), p)) != 0:
+            return False
+    return True
+
+
+@rule()
+def all_property_merged(eg, p):
+    for pred in (OWL.sameAs, OWL.equivalentProperty):
+        pred = eg.id(pred)
+        if len(eg.objects(p, pred)) != 0 or len(eg.subjects(pred, p)) != 0:
+            return False
+    return True
+
+
+def merge_same_property(eg, state):
+    for focus_property in state.paths:
+        check_irreflexiveProperty(eg, focus_property)
+        check_asymmetricProperty(eg, focus_property)
+        merge_sub_properties(eg, focus_property)
+        merge_equivalent_properties(eg, state, focus_property)
+        check_propertyDisjointWith(eg, focus_property)
+        check_symmetricProperty(eg, focus_property)
+        check_transitiveProperty(eg, focus_property)
+        check_inverseOf(eg, focus_property)
+        check_domain_range(eg, focus_property, state)
+        check_com_dw(eg, state.classes)
+        check_FunctionalProperty(eg, focus_property)
+        check_InverseFunctionalProperty(eg, focus_property)
+
+
+@rule("prp-spo1")
+def merge_sub_properties(eg, focus_property):
+    sub_property = eg.id(RDFS.subPropertyOf)
+    same_as = eg.id(OWL.sameAs)
+    subs = eg.subjects(sub_property, focus_property).tolist()
+    while len(subs) != 0:
+        for sub_p in subs:
+            if eg.contains(focus_property, sub_property, sub_p): # scm-eqp2
+                eg.add(same_as, focus_property, sub_p)
+            else:
+                p3 = eg.subjects(sub_property, sub_p) # RULE scm-spo
+                p3 = p3[p3 != focus_property]
+                eg.add(sub_property, p3, np.full(len(p3), focus_property))
+                for c in eg.objects(focus_property, eg.id(RDFS.domain)).tolist(): # scm-dom2
+                    eg.add(eg.id(RDFS.domain), sub_p, c)
+                for c in eg.objects(focus_property, eg.id(RDFS.range)).tolist(): # scm-rng2
+                    eg.add(eg.id(RDFS.range), sub_p, c)
+                x, y = eg.pairs(sub_p) # prp-spo1
+                eg.add(focus_property, x, y)
+            eg.remove(sub_property, sub_p, focus_property)
+        subs = eg.subjects(sub_property, focus_property).tolist()
+
+
+@rule("eq-rep-p")
+def merge_equivalent_properties(eg, state, focus_property):
+    same_as = eg.id(OWL.sameAs)
+    eq_property = eg.id(OWL.equivalentProperty)
+    while not all_property_merged(eg, focus_property):
+        for p1 in eg.subjects(eq_property, focus_property).tolist():
+            eg.remove(eq_property, p1, focus_property)
+            eg.add(same_as, focus_property, p1)
+        for p2 in eg.objects(focus_property, eq_property).tolist():
+            eg.remove(eq_property, focus_property, p2)
+            eg.add(same_as, focus_property, p2)
+        for same_prop in eg.subjects(same_as, focus_property).tolist():
+            eg.remove(same_as, same_prop, focus_property)
+            eg.add(same_as, focus_property, same_prop)
+
+        for same_property in eg.objects(focus_property, same_as).tolist():
+            check_irreflexiveProperty(eg, same_property)
+            check_asymmetricProperty(eg, same_property)
+            if same_property != focus_property:
+                eg.move_term(same_property, focus_property, keep=same_property in state.paths)
+            eg.remove(same_as, focus_property, same_property)
+        eg.remove(same_as, focus_property, focus_property)
+
+
+@rule("eq-rep-s/o")
+def merge_same_focus_nodes(eg, state):
+    s, o = eg.pairs(eg.id(OWL.sameAs))
+    keep = ~(eg.literal[s] | eg.literal[o])
+    s = s[keep]
+    o = o[keep]
+    if len(s) == 0:
+        return
+    nodes = np.unique(np.concatenate((s, o)))
+    label = components(len(nodes), np.searchsorted(nodes, s), np.searchsorted(nodes, o))
+
+    # the canonical representative is a focus node, IRIs before blank nodes
+    best = dict()
+    for i in np.nonzero(state.is_target[nodes])[0].tolist():
+        term = eg.terms.decode(nodes[i])
+        key = (isinstance(term, BNode), str(term))
+        c = label[i]
+        if c not in best or key < best[c][0]:
+            best[c] = (key, nodes[i])
+    if len(best) == 0:
+        return
+    canonical_of_label = np.full(len(nodes), -1, dtype=np.int64)
+    for c, (key, node) in best.items():
+        canonical_of_label[c] = node
+    canonical = canonical_of_label[label]
+    alias = (canonical >= 0) & (nodes != canonical)
+    alias_ids = nodes[alias]
+    alias_canonical = canonical[alias]
+
+    for x, focus in zip(alias_ids.tolist(), alias_canonical.tolist()):
+        same_set = state.same.setdefault(focus, set())
+        same_set.add(x)
+        if x in state.same:
+            same_set.update(state.same.pop(x))
+    for focus in set(alias_canonical.tolist()):
+        state.same[focus].discard(focus)
+
+    rep = np.arange(eg.n)
+    rep[alias_ids] = alias_canonical
+    touched = np.zeros(eg.n, dtype=bool)
+    touched[alias_ids] = True
+
+    d1, d2 = eg.pairs(eg.id(OWL.differentFrom)) # eq-diff1
+    clash = (rep[d1] == rep[d2]) & (touched[d1] | touched[d2])
+    if clash.any():
+        raise FusionRuntimeError(
+            "'sameAs' and 'differentFrom' cannot be used on the same subject-object pair: (%s, %s)"
+            % (eg.terms.decode(d1[clash][0]), eg.terms.decode(d2[clash][0])))
+
+    eg.rewrite(rep, touched)
+    # the chosen focus node of every clique, also a clique of one that only
+    # has (f owl:sameAs f)
+    focus = np.array(sorted(node for key, node in best.values()), dtype=np.int64)
+    eg.remove(eg.id(OWL.sameAs), focus, focus)
+
+
+def encoded_fixpoint(vg, found_node_targets, same_nodes, target_classes, path_value, stats=None):
+    terms = TermDictionary()
+    eg = EncodedGraph(vg, terms, chain(VOCABULARY, target_classes, path_value, found_node_targets,
+                                       same_nodes.keys(), *same_nodes.values()))
+    state = EncodedState(eg, found_node_targets, same_nodes, target_classes, path_value)
+
+    while (not all_targetClasses_merged(eg, state)) or (not all_samePath_merged(eg, state)):
+        if stats is not None:
+            stats["rounds"] = stats.get("rounds", 0) + 1
+        profiling.next_round()
+        merge_target_classes(eg, state)
+        target_domain_range(eg, state)
+
+        # merge same properties
+        merge_same_property(eg, state)
+
+        # merge same nodes
+        merge_same_focus_nodes(eg, state)
+        check_com_dw(eg, state.classes)
+
+    eg.decode_into(vg)
+    decode = terms.decode
+    found_node_targets.clear()
+    found_node_targets.update(decode(x) for x in np.nonzero(state.is_target)[0].tolist())
+    same_nodes.clear()
+    for f, same_set in state.same.items():
+        same_nodes.add(decode(f))
+        for o in same_set:
+            same_nodes.merge(decode(f), decode(o))
+    target_classes.update(decode(c) for c in state.classes)
+    return vg
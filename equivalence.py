@@ -0,0 +1,47 @@
+class EquivalenceIndex:
+    # disjoint-set forest with path compression and union by rank
+
+    def __init__(self):
+        self.parent = dict()
+        self.rank = dict()
+
+    def __contains__(self, x):
+        return x in self.parent
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, x):
+        if x not in self.parent:
+            self.parent[x] = x
+            self.rank[x] = 0
+
+    def find(self, x):
+        self.add(x)
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root: # path compression
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x, y):
+        rx = self.find(x)
+        ry = self.find(y)
+        if rx == ry:
+            return rx
+        if self.rank[rx] < self.rank[ry]:
+            rx, ry = ry, rx
+        self.parent[ry] = rx
+        if self.rank[rx] == self.rank[ry]:
+            self.rank[rx] += 1
+        return rx
+
+    def same(self, x, y):
+        return self.find(x) == self.find(y)
+
+    def classes(self):
+        members = dict()
+        for x in self.parent:
+            members.setdefault(self.find(x), set()).add(x)
+        return members
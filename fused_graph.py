@@ -1,14 +1,35 @@
 
+import os
+import time
+
 from errors import FusionRuntimeError
+from equivalence import EquivalenceIndex
+from closure import TransitiveClosure
+from consistency import ConsistencyChecks, violation
+from plan import load_plan
+from tracking import TrackingGraph
+from batch import WriteBatch
+from same_nodes import SameNodes
+from view import noiseless_view
+from ntriples import write_ntriples
+from sharding import components, shards_of
+from sqlite_store import SQLiteStore, bulk_load
+from fusion_cache import FusionCache, fusion_cache_of
+import profiling
+from profiling import rule
 from pyshacl.pytypes import GraphLike
 import rdflib
 
-from rdflib.namespace import OWL, RDF, RDFS
+from rdflib.namespace import OWL, RDF, RDFS, SH
+from rdflib.util import guess_format
 
+from pyshacl.graph_abstraction import DataGraph
 from pyshacl.shapes_graph import ShapesGraph
+from pyshacl.validator import Validator, assign_baked_in
 
-from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Set, Tuple, Union, cast
+from typing import IO, TYPE_CHECKING, Dict, Iterator, List, Optional, Set, Tuple, Union, cast
 from rdflib import BNode, Literal, URIRef
+from rdflib.store import Store
 
 from pyshacl.monkey import apply_patches, rdflib_bool_patch, rdflib_bool_unpatch
 from pyshacl.rdfutil import (
@@ -21,6 +42,7 @@ from pyshacl.rdfutil import (
     mix_graphs,
     order_graph_literal,
 )
+from itertools import chain
 from pyshacl.consts import (
     SH_path,
     RDFS_subClassOf,
@@ -30,30 +52,192 @@ if TYPE_CHECKING:
     from pyshacl.constraints import ConstraintComponent
     from pyshacl.shapes_graph import ShapesGraph
 
+# schema predicates whose removal from an already fused graph needs a full refusion
+SCHEMA_TERMS = {
+    OWL.equivalentClass,
+    OWL.equivalentProperty,
+    RDFS.subClassOf,
+    RDFS.subPropertyOf,
+    RDFS.domain,
+    RDFS.range,
+    OWL.inverseOf,
+    OWL.propertyDisjointWith,
+    OWL.complementOf,
+    OWL.disjointWith,
+}
+
+PROPERTY_CHARACTERISTICS = {
+    OWL.FunctionalProperty,
+    OWL.InverseFunctionalProperty,
+    OWL.SymmetricProperty,
+    OWL.AsymmetricProperty,
+    OWL.TransitiveProperty,
+    OWL.IrreflexiveProperty,
+}
+
+# schema predicates whose triples trigger merge_same_property on their terms
+SCHEMA_PROPERTY_TERMS = {
+    OWL.sameAs,
+    OWL.equivalentProperty,
+    RDFS.subPropertyOf,
+    OWL.inverseOf,
+    OWL.propertyDisjointWith,
+    RDFS.domain,
+    RDFS.range,
+}
+
+
+# pending triples per convergence check, see TrackingGraph
+CLASS_PENDING = (OWL.equivalentClass, OWL.sameAs)
+PROPERTY_PENDING = (OWL.sameAs, OWL.equivalentProperty)
+PATH_PENDING = (OWL.sameAs, OWL.equivalentProperty, RDFS.subPropertyOf)
+FOCUS_PENDING = (OWL.sameAs,)
+SUB_PROPERTY_PENDING = (RDFS.subPropertyOf,)
+
+
+# vocabulary the fusion rules read, kept by the streaming loader in any case
+RULE_VOCABULARY = SCHEMA_TERMS.union({
+    RDF.type,
+    OWL.sameAs,
+    OWL.differentFrom,
+})
+
+# shapes that can look at arbitrary predicates, the streaming loader keeps everything for them
+UNFILTERED_SHAPE_TERMS = (SH.closed, SH.sparql, SH.select, SH.ask)
+
+STREAMING_FORMATS = ("turtle", "ttl", "nt", "ntriples", "nt11", "n3")
+
+
+class RelevantTriplesGraph(rdflib.Graph):
+    # parser sink that drops every triple whose predicate is not in `predicates`
+
+    def __init__(self, predicates, **kwargs):
+        super().__init__(**kwargs)
+        self.predicates = predicates
+
+    def add(self, triple):
+        if triple[1] in self.predicates:
+            return super().add(triple)
+        return self
+
+
+class SchemaEdgesGraph(rdflib.Graph):
+    # parser sink that stores nothing but the schema edges between IRIs
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.edges = dict()
+
+    def add(self, triple):
+        s, p, o = triple
+        if p in SCHEMA_PROPERTY_TERMS or p in (RDFS.subClassOf, OWL.equivalentClass):
+            if isinstance(s, URIRef) and isinstance(o, URIRef):
+                self.edges.setdefault(p, []).append((s, o))
+        return self
+
+
+def parse_source(data_graph, data_graph_format=None):
+    # Graph.parse() keywords for a file name or serialized data
+    if isinstance(data_graph, bytes):
+        data_graph = data_graph.decode("utf-8")
+    if not isinstance(data_graph, str):
+        return None
+    if "\n" not in data_graph and os.path.isfile(data_graph):
+        rdf_format = data_graph_format or guess_format(data_graph) or "turtle"
+        return dict(source=data_graph, format=rdf_format)
+    return dict(data=data_graph, format=data_graph_format or "turtle")
+
+
+def stream_source(data_graph, data_graph_format=None):
+    source = parse_source(data_graph, data_graph_format)
+    if source is None or source["format"] not in STREAMING_FORMATS:
+        return None
+    return source
+
+
+def relevant_predicates(sg, edges):
+    vocabulary = set(t for triple in sg for t in triple if isinstance(t, URIRef))
+    classes = set(vocabulary)
+    predicates = set(vocabulary)
+    changed = True
+    while changed:
+        size = len(classes) + len(predicates)
+        for s, o in edges.get(RDFS.subClassOf, ()):
+            if o in classes:
+                classes.add(s)
+        for p in (OWL.equivalentClass, OWL.sameAs):
+            for s, o in edges.get(p, ()):
+                if s in classes or o in classes:
+                    classes.update((s, o))
+        for s, o in edges.get(RDFS.subPropertyOf, ()): # prp-spo1
+            if o in predicates:
+                predicates.add(s)
+        for p in (OWL.equivalentProperty, OWL.sameAs, OWL.inverseOf):
+            for s, o in edges.get(p, ()):
+                if s in predicates or o in predicates:
+                    predicates.update((s, o))
+        for p in (RDFS.domain, RDFS.range): # prp-dom, prp-rng
+            for s, o in edges.get(p, ()):
+                if o in classes:
+                    predicates.add(s)
+        changed = len(classes) + len(predicates) != size
+    return predicates.union(RULE_VOCABULARY)
+
+
+def stream_relevant_triples(data_graph, sg, data_graph_format=None, store="default"):
+    # Two streaming passes over the data: the first one only collects the
+    # schema edges, the second one keeps the triples whose predicate is
+    # reachable from the shapes vocabulary through those edges.
+    source = stream_source(data_graph, data_graph_format)
+    if source is None:
+        return None
+    for term in UNFILTERED_SHAPE_TERMS:
+        if any(True for _ in sg.subjects(term, None)):
+            return None
+    
+    schema = SchemaEdgesGraph()
+    schema.parse(**source)
+    predicates = relevant_predicates(sg, schema.edges)
+    
+    sink = RelevantTriplesGraph(predicates, store=store)
+    sink.parse(**source)
+    sink.store.commit()
+    return rdflib.Graph(sink.store, sink.identifier, namespace_manager=sink.namespace_manager)
+
 
 def load_graph(data_graph: Union[GraphLike, str, bytes],
     shacl_graph: Optional[Union[GraphLike, str, bytes]] = None,
     data_graph_format: Optional[str] = None,
     shacl_graph_format: Optional[str] = None,
+    streaming: bool=False,
+    plan_cache: Optional[str] = None,
+    store: Optional[Union[Store, str]] = None,
     ):
+    # store: fuse in a persistent store (a Store, or the path of a SQLite
+    # database) instead of in memory; data_graph=None fuses what it holds
     
-    loaded_dg = load_from_source(data_graph, rdf_format=data_graph_format, multigraph=True, do_owl_imports=False)
+    plan = load_plan(shacl_graph, shacl_graph_format, plan_cache)
+    if store is not None and not isinstance(store, Store):
+        store = SQLiteStore(store)
+    
+    loaded_dg = None
+    if streaming:
+        loaded_dg = stream_relevant_triples(data_graph, plan.graph(), data_graph_format, store or "default")
+    if loaded_dg is None and store is not None:
+        loaded_dg = rdflib.Graph(store=store)
+        if data_graph is not None:
+            source = data_graph if isinstance(data_graph, rdflib.Graph) else parse_source(data_graph, data_graph_format)
+            if source is None:
+                raise RuntimeError("data_graph must be a rdflib Graph, a file name or serialized RDF")
+            bulk_load(loaded_dg, source)
+    if loaded_dg is None:
+        loaded_dg = load_from_source(data_graph, rdf_format=data_graph_format, multigraph=True, do_owl_imports=False)
     if not isinstance(loaded_dg, rdflib.Graph):
         raise RuntimeError("data_graph must be a rdflib Graph object")
+    return plan, named_graphs_of(loaded_dg)
 
-    if shacl_graph is not None:
-        rdflib_bool_patch()
-        loaded_sg = load_from_source(
-            shacl_graph, rdf_format=shacl_graph_format, multigraph=True, do_owl_imports=False)
-        rdflib_bool_unpatch()
-    else:
-        loaded_sg = None
-        
-    assert isinstance(loaded_sg, rdflib.Graph), "shacl_graph must be a rdflib Graph object"
-    shape_graph = ShapesGraph(loaded_sg, None)  # type: ShapesGraph
-    
-    shapes = shape_graph.shapes  # This property getter triggers shapes harvest.
-       
+
+def named_graphs_of(loaded_dg):
     the_target_graph = loaded_dg
     if isinstance(the_target_graph, (rdflib.Dataset, rdflib.ConjunctiveGraph)):
         named_graphs = [
@@ -65,7 +249,7 @@ def load_graph(data_graph: Union[GraphLike, str, bytes],
     else:
         named_graphs = [the_target_graph]
         
-    return shapes, named_graphs
+    return named_graphs
     
     
 
@@ -74,56 +258,188 @@ def fused_graph(
     shacl_graph: Optional[Union[GraphLike, str, bytes]] = None,
     data_graph_format: Optional[str] = None,
     shacl_graph_format: Optional[str] = None,
+    semi_naive: bool=False,
+    streaming: bool=False,
+    backend: str="rdflib",
+    stats: Optional[dict] = None,
+    profile: bool=False,
+    plan_cache: Optional[str] = None,
+    violations: Optional[list] = None,
+    store: Optional[Union[Store, str]] = None,
+    cache: Optional[Union[FusionCache, str]] = None,
+    destination: Optional[Union[str, IO]] = None,
+    compress: Optional[bool] = None,
     ):
     
-    shapes, named_graphs = load_graph( data_graph, shacl_graph, data_graph_format,shacl_graph_format)    
+    # results are only cached for plain in-memory runs
+    cache = fusion_cache_of(cache) if not (profile or violations is not None or store is not None
+                                           or destination is not None) else None
+    key = None
+    if cache is not None:
+        key = cache.key(data_graph, data_graph_format, shacl_graph, shacl_graph_format,
+                        noiseless=False, semi_naive=semi_naive, streaming=streaming, backend=backend)
+        cached = None if key is None else cache.get(key)
+        if cached is not None:
+            return cached
+    
+    plan, named_graphs = load_graph( data_graph, shacl_graph, data_graph_format,shacl_graph_format, streaming, plan_cache, store)    
 
-    for g in named_graphs:
-        vg = g 
-        found_node_targets = set()
-        target_classes = set()
-        path_value = set()
-        found_target_classes = set()
-        same_nodes = dict()
-        for s in shapes:
-            focus = s.focus_nodes(vg)
-            found_node_targets.update(focus)
-            target_classes.update(s.target_classes())
-            target_classes.update(s.implicit_class_targets())
-                
-            target_property=set(s.property_shapes())            
-            for blin in target_property:
-                path_value.update(s.sg.graph.objects(blin, SH_path))
+    fusion_profile = profiling.FusionProfile() if profile else None
+    with profiling.recording(fusion_profile):
+        for g in named_graphs:
+            vg = g 
+            same_nodes, found_node_targets, target_classes, global_path = fuse_named_graph(
+                vg, plan, semi_naive, backend, stats, violations)
+                                   
+    if destination is not None:
+        # N-Triples straight from the store, no serializer buffers the graph
+        write_ntriples(vg.triples((None, None, None)), destination, compress)
+    if profile:
+        return vg, same_nodes, fusion_profile
+    if key is not None:
+        cache.put(key, vg, same_nodes)
+    return vg, same_nodes
+
+
+def fuse_named_graph(vg, plan, semi_naive=False, backend="rdflib", stats=None, violations=None):
+    found_node_targets, target_classes, path_value, global_path = plan.targets(vg)
+    
+    same_nodes = SameNodes(found_node_targets)
+    fixpoint(vg, found_node_targets, same_nodes, target_classes, path_value, semi_naive, backend, stats, violations)
+    vg.store.commit() # persistent stores write their buffered changes
+    return same_nodes, found_node_targets, target_classes, global_path
+
+def fixpoint(vg, found_node_targets, same_nodes, target_classes, path_value, semi_naive=False, backend="rdflib", stats=None, violations=None, checks=None):
+    # stats, if given, receives the number of fixpoint rounds; violations, if
+    # given, collects every inconsistency found instead of raising the first;
+    # checks, if given, is the ConsistencyChecks to go on with
+    if stats is None:
+        stats = dict()
+    stats["rounds"] = 0
+    if backend == "numpy":
+        if violations is not None:
+            raise RuntimeError("Collecting violations is only supported by the 'rdflib' backend")
+        from encoded import encoded_fixpoint # optional dependency on numpy
+        return encoded_fixpoint(vg, found_node_targets, same_nodes, target_classes, path_value, stats)
+    if backend != "rdflib":
+        raise RuntimeError("Unknown fusion backend %s, use 'rdflib' or 'numpy'" % backend)
+    if semi_naive:
+        return seminaive_fixpoint(vg, found_node_targets, same_nodes, target_classes, path_value, stats=stats,
+                                  violations=violations, checks=checks)
+    
+    # pending counters for the convergence checks, deltas only for the profiler
+    g = TrackingGraph(vg, record=profiling.active is not None)
+    if checks is None:
+        checks = ConsistencyChecks(violations)
+    while (not all_targetClasses_merged(g, target_classes)) or (not all_samePath_merged(g, path_value)):
+        stats["rounds"] += 1
+        profiling.next_round()
         
-        for tc in target_classes:
-            subc = vg.transitive_subjects(RDFS_subClassOf, tc)
-            for subclass in subc:
-                if subclass == tc:
-                    continue
-                found_target_classes.add(subclass)
-        target_classes.update(found_target_classes)
+        merge_target_classes(g, found_node_targets, same_nodes, target_classes)
+        target_domain_range(g, found_node_targets, same_nodes, target_classes)
         
-        for f in found_node_targets:
-            same_set = set()
-            same_nodes.update({f: same_set})
+        # merge same properties 
+        merge_same_property(g, path_value, found_node_targets, same_nodes, target_classes)
         
+        # merge same nodes
+        merge_same_focus_nodes(g, same_nodes, found_node_targets, violations=violations)
+        checks.run(g, target_classes, path_value, g.take_touched())
+        g.delta()
+    return vg
+
+
+def seminaive_fixpoint(vg, found_node_targets, same_nodes, target_classes, path_value, delta=None, stats=None, violations=None, checks=None):
+    # Every round only looks at the classes, path properties and focus nodes
+    # touched by the triples derived in the round before. delta=None means
+    # that the whole graph is new, i.e. the first round visits everything;
+    # that run has the stopping rule of fixpoint (until every target class
+    # and path property is merged), so both compute the same graph. Given a
+    # delta (FusedGraph updates), it runs until a round derives nothing.
+    tg = TrackingGraph(vg)
+    if checks is None:
+        checks = ConsistencyChecks(violations)
+    until_merged = delta is None
+    while delta is None or len(delta) != 0:
+        if until_merged and all_targetClasses_merged(tg, target_classes) and all_samePath_merged(tg, path_value):
+            break
+        if stats is not None:
+            stats["rounds"] = stats.get("rounds", 0) + 1
+        profiling.next_round()
+        known_targets = set(found_node_targets)
+        known_classes = set(target_classes)
+        if delta is None:
+            classes = set(target_classes)
+            domain_classes = set(target_classes)
+            properties = set(path_value)
+            focus_nodes = set(found_node_targets)
+        else:
+            classes, domain_classes, properties, focus_nodes = delta_terms(
+                tg, delta, found_node_targets, target_classes, path_value)
+            # a class or property can become a target with its axioms
+            # already in the graph, fixpoint would merge them in this round
+            classes.update(tg.pending_terms(target_classes, CLASS_PENDING))
+            properties.update(tg.pending_terms(path_value, PATH_PENDING))
         
-        while (not all_targetClasses_merged(vg, target_classes)) or (not all_samePath_merged(vg, path_value)):
-            
-            merge_target_classes(vg, found_node_targets, same_nodes, target_classes)
-            target_domain_range(vg, found_node_targets, same_nodes, target_classes)
-            
-            # merge same properties 
-            merge_same_property(vg, path_value, found_node_targets, same_nodes, target_classes)
-            
-            # merge same nodes
-            for focus_node in found_node_targets:      
-                while not all_focus_merged(vg, focus_node):
-                    merge_same_focus(vg, same_nodes, focus_node)  
-                    check_com_dw(vg, target_classes)
-                                   
-    return vg, same_nodes
+        merge_target_classes(tg, found_node_targets, same_nodes, classes)
+        target_classes.update(classes)
+        domain_classes.update(target_classes - known_classes)
+        target_domain_range(tg, found_node_targets, same_nodes, domain_classes)
+        
+        # merge same properties 
+        merge_same_property(tg, path_value, found_node_targets, same_nodes, target_classes, properties)
+        
+        # merge same nodes
+        focus_nodes.update(found_node_targets - known_targets)
+        merge_same_focus_nodes(tg, same_nodes, focus_nodes.intersection(found_node_targets), local=delta is not None,
+                               violations=violations)
+        checks.run(tg, target_classes, path_value, tg.take_touched())
+        
+        delta = tg.delta()
+    return vg
+
 
+def delta_terms(g, delta, found_node_targets, target_classes, path_value):
+    classes = set()
+    domain_classes = set()
+    properties = set()
+    focus_nodes = set()
+    predicates = set()
+    for s, p, o in delta:
+        predicates.add(p)
+        if p == OWL.sameAs:
+            focus_nodes.add(s)
+            focus_nodes.add(o)
+        if p == OWL.sameAs or p == OWL.equivalentClass:
+            classes.update(target_classes.intersection((s, o)))
+        if p in SCHEMA_PROPERTY_TERMS:
+            properties.update(path_value.intersection((s, o)))
+        if p == RDF.type:
+            if s in path_value: # property characteristics
+                properties.add(s)
+            focus_nodes.add(s)
+        if p == RDFS.domain or p == RDFS.range:
+            domain_classes.add(o)
+    
+    for p in predicates:
+        if p in path_value:
+            properties.add(p)
+        for q in g.objects(p, RDFS.subPropertyOf): # prp-spo1
+            properties.add(q)
+        for q in g.objects(p, OWL.inverseOf): # prp-inv1, prp-inv2
+            properties.add(q)
+        for q in g.subjects(OWL.inverseOf, p):
+            properties.add(q)
+        for c in g.objects(p, RDFS.domain): # prp-dom, prp-rng
+            domain_classes.add(c)
+        for c in g.objects(p, RDFS.range):
+            domain_classes.add(c)
+    
+    return (classes,
+            domain_classes.intersection(target_classes),
+            properties.intersection(path_value),
+            focus_nodes.intersection(found_node_targets))
+
+@rule("prp-symp")
 def check_symmetricProperty(g, p): # RULE prp-symp
     if (p, RDF.type, OWL.SymmetricProperty) in g:
         for x, y in g.subject_objects(p):
@@ -131,41 +447,17 @@ def check_symmetricProperty(g, p): # RULE prp-symp
         #g.remove((p, RDF.type, OWL.SymmetricProperty))
     
 
-def check_asymmetricProperty(g, p): # prp-asyp
-    if (p, RDF.type, OWL.AsymmetricProperty) in g:
-        for x, y in g.subject_objects(p):
-            if (y, p, x) in g:
-                raise FusionRuntimeError(
-                    "Erroneous usage of asymmetric property %s on %s and %s"
-                    % (p, x, y)
-                )
-   
+
+@rule("prp-trp")
 def check_transitiveProperty(g, p):    #TODO: Test transitiveP
     if (p, RDF.type, OWL.TransitiveProperty) in g: 
-        for s, o in g.subject_objects(p):
-            trans = g.transitive_objects(s, p)
-            for o in trans:          
-                g.add((s, p, o))  
+        # one closure per property instead of transitive_objects per edge
+        closure = TransitiveClosure(g.subject_objects(p))
+        subjects = [s for s, successors in closure.successors.items() if len(successors) != 0]
+        g.addN((s, p, o, g) for s in subjects for o in closure.reachable(s))
                 
-def check_propertyDisjointWith(g, focus_property): # prp-pdw
-    for p in g.objects(focus_property, OWL.propertyDisjointWith):
-        for x, y in g.subject_objects(focus_property):
-            if (x, p, y) in g:
-                raise FusionRuntimeError(
-                    "Erroneous usage of disjoint properties %s and %s on %s and %s"
-                    % (focus_property, p, x, y)
-                )
-    """
-    for p in g.subjects(OWL.propertyDisjointWith, focus_property):
-        for x, y in g.subject_objects(p):
-            if (x, focus_property, y) in g:
-                raise FusionRuntimeError(
-                    "Erroneous usage of disjoint properties %s and %s on %s and %s"
-                    % (p, focus_property, x, y)
-                )
-    """
-    
-    
+
+@rule("prp-inv")
 def check_inverseOf(g, focus_property): #TODO: Test for inverseOf
     for p1 in g.subjects(OWL.inverseOf, focus_property): 
         for x, y in g.subject_objects(p1):
@@ -179,14 +471,14 @@ def check_inverseOf(g, focus_property): #TODO: Test for inverseOf
             g.add((yy, p2, xx))
         
     
+@rule("prp-dom/rng")
 def check_domain_range(g, p, target_nodes, same_nodes, target_classes):
     for o in g.objects(p, RDFS.domain): # RULE prp-dom  
         for x, y in g.subject_objects(p):
             g.add((x, RDF.type, o))
             if (o in target_classes) and (not x in target_nodes):
                 target_nodes.add(x)
-                same_set = set()
-                same_nodes.update({x: same_set})
+                same_nodes.add(x)
 
 
     for o in g.objects(p, RDFS.range): # RULE prp-rng
@@ -194,11 +486,11 @@ def check_domain_range(g, p, target_nodes, same_nodes, target_classes):
             g.add((y, RDF.type, o))
             if (o in target_classes) and (not y in target_nodes):
                 target_nodes.add(y)
-                same_set = set()
-                same_nodes.update({y: same_set})
+                same_nodes.add(y)
                     
     return target_nodes
 
+@rule("prp-dom/rng")
 def target_domain_range(g, target_nodes, same_nodes, target_classes):
     for c in target_classes:
         for p in g.subjects(RDFS.domain, c):
@@ -207,8 +499,7 @@ def target_domain_range(g, target_nodes, same_nodes, target_classes):
                     g.add((s, RDF.type, c))
                 if not s in target_nodes:
                     target_nodes.add(s)
-                    same_set = set()
-                    same_nodes.update({s: same_set})
+                    same_nodes.add(s)
                 
         for pp in g.objects(RDFS.range, c):
             for s, o in g.subject_objects(pp):
@@ -216,68 +507,28 @@ def target_domain_range(g, target_nodes, same_nodes, target_classes):
                     g.add((o, RDF.type, c))
                 if not o in target_nodes:
                     target_nodes.add(o)
-                    same_set = set()
-                    same_nodes.update({o: same_set})
-
-def check_com_dw(g, class_list):
-    for target_class in class_list:
-        # RULE cls-com
-        for c2 in g.objects(target_class, OWL.complementOf):
-            for x in g.subjects(RDF.type, target_class):
-                if (x, RDF.type, c2) in g:
-                    raise FusionRuntimeError(
-                        "Violation of complementarity for classes %s and %s on element %s (or an identical individual with it)"
-                        % (target_class, c2, x)
-                    )
-                    
-        for c1 in g.subjects(OWL.complementOf, target_class):
-            for x in g.subjects(RDF.type, c1):
-                if (x, RDF.type, target_class) in g:
-                    raise FusionRuntimeError(
-                        "Violation of complementarity for classes %s and %s on element %s (or an identical individual with it)"
-                        % (c1, target_class, x)
-                    )
-    
-        # RULE cax-dw 
-        for c2 in g.objects(target_class, OWL.disjointWith):
-            for x in g.subjects(RDF.type, target_class):
-                if (x, RDF.type, c2) in g:
-                    raise FusionRuntimeError(
-                        "Disjoint classes %s and %s have a common individual %s (or an identical individual with it)"
-                        % (target_class, c2, x)
-                    )
-                    
-        for c1 in g.subjects(OWL.disjointWith, target_class):
-            for x in g.subjects(RDF.type, c1):
-                if (x, RDF.type, target_class) in g:
-                    raise FusionRuntimeError(
-                        "Disjoint classes %s and %s have a common individual %s (or an identical individual with it)"
-                        % (c1, target_class, x)
-                    )
+                    same_nodes.add(o)
 
-    
-    
 
-def check_eq_diff_erro(g, s, o):
+
+
+@rule("eq-diff1")
+def check_eq_diff_erro(g, s, o, violations=None):
     if (s, OWL.differentFrom, o) in g or (
         o,
         OWL.differentFrom,
         s,
     ) in g:
-        raise FusionRuntimeError(
+        violation(violations,
                 "'sameAs' and 'differentFrom' cannot be used on the same subject-object pair: (%s, %s)"
                     % (s, o)
             )
              
-def check_irreflexiveProperty(g,p): # RULE prp-irp
-    if (p, RDF.type, OWL.IrreflexiveProperty) in g:
-        for x, y in g.subject_objects(p):
-            if x == y:
-                raise FusionRuntimeError(
-                        "Irreflexive property used on %s with %s" % (x, p)
-                    ) 
 
+@rule()
 def all_samePath_merged(g, path_value):
+    if isinstance(g, TrackingGraph):
+        return g.merged(path_value, PATH_PENDING)
     for p in path_value:
         m1 = [o for o in g.objects(p, OWL.sameAs)]
         m2 = [s for s in g.subjects(OWL.sameAs, p)]          
@@ -289,7 +540,10 @@ def all_samePath_merged(g, path_value):
     return True
 
 
+@rule()
 def all_property_merged(g, property):
+    if isinstance(g, TrackingGraph):
+        return g.merged((property,), PROPERTY_PENDING)
     m1 = [o for o in g.objects(property, OWL.sameAs)]
     if len(m1)!= 0:
         return False
@@ -304,7 +558,10 @@ def all_property_merged(g, property):
         return False 
     return True
 
+@rule()
 def all_focus_merged(g, focus):
+    if isinstance(g, TrackingGraph):
+        return g.merged((focus,), FOCUS_PENDING)
 
     m1 = [o for o in g.objects(focus, OWL.sameAs)] # focus node = o exists
     if len(m1)!= 0:
@@ -314,33 +571,53 @@ def all_focus_merged(g, focus):
         return False             
     return True
 
+@rule("prp-fp")
 def check_FunctionalProperty(g, focus_property):
     # prp-fp
     if (focus_property, RDF.type, OWL.FunctionalProperty) in g: 
-        for x, y1 in g.subject_objects(focus_property):
-            for y2 in g.objects(x, focus_property):
-                if y1 != y2:
-                    #if y1 in found_node_targets or y2 in found_node_targets:
-                    g.add((y1, OWL.sameAs, y2))
+        values = dict()
+        for x, y in g.subject_objects(focus_property):
+            values.setdefault(x, set()).add(y)
+        add_same_stars(g, values.values())
         #g.remove((focus_property, RDF.type, OWL.FunctionalProperty))
     
+@rule("prp-ifp")
 def check_InverseFunctionalProperty(g, focus_property):
     # prp-ifp
     if (focus_property, RDF.type, OWL.InverseFunctionalProperty) in g:
-        for x1, y in g.subject_objects(focus_property):
-            for x2 in g.subjects(focus_property, y):
-                if x1 != x2:
-                    #if x1 in found_node_targets or x2 in found_node_targets:
-                    g.add((x1, OWL.sameAs, x2))
+        values = dict()
+        for x, y in g.subject_objects(focus_property):
+            values.setdefault(y, set()).add(x)
+        add_same_stars(g, values.values())
         #g.remove((focus_property, RDF.type, OWL.InverseFunctionalProperty))
+
+
+def add_same_stars(g, groups):
+    # one sameAs from every member to the representative of its group instead
+    # of one per ordered pair, merge_same_focus_nodes closes them transitively
+    for group in groups:
+        if len(group) > 1:
+            representative = min(group, key=node_order)
+            g.addN((x, OWL.sameAs, representative, g) for x in group if x != representative)
+
+
+def node_order(n):
+    # IRIs before blank nodes, then lexically
+    return (isinstance(n, BNode), str(n))
         
+@rule()
 def all_subProperties_merged(g, p):
+    if isinstance(g, TrackingGraph):
+        return g.merged((p,), SUB_PROPERTY_PENDING)
     m1 = [s for s in g.subjects(RDFS.subPropertyOf, p)]
     if len(m1)!= 0:
         return False
     return True
 
+@rule()
 def all_targetClasses_merged(g, target_classes):
+    if isinstance(g, TrackingGraph):
+        return g.merged(target_classes, CLASS_PENDING)
     for c in target_classes:
         m1 = [s for s in g.subjects(OWL.equivalentClass, c)]
         m2 = [s for s in g.objects(c, OWL.equivalentClass)]
@@ -350,7 +627,10 @@ def all_targetClasses_merged(g, target_classes):
             return False
     return True
 
+@rule()
 def sameClasses_merged(g, target_class):
+    if isinstance(g, TrackingGraph):
+        return g.merged((target_class,), CLASS_PENDING)
     m1 = [s for s in g.subjects(OWL.equivalentClass, target_class)]
     m2 = [s for s in g.objects(target_class, OWL.equivalentClass)]
     m3 = [s for s in g.subjects(OWL.sameAs, target_class)]
@@ -359,177 +639,203 @@ def sameClasses_merged(g, target_class):
         return False
     return True
 
+def pending_only(g, terms, predicates):
+    # on a TrackingGraph the loops skip the terms without pending triples
+    if not isinstance(g, TrackingGraph):
+        return terms
+    pending = g.pending_terms(terms, predicates)
+    return [t for t in terms if t in pending]
+
+
+@rule("cax-eqc")
 def merge_target_classes(g, found_node_targets, same_nodes, target_classes):  #TODO: subClass use cases
     eq_targetClass = set()
     eq_targetNodes = set()
-    for c in target_classes:
+    for c in pending_only(g, target_classes, CLASS_PENDING):
         while not sameClasses_merged(g, c):
-            for c1 in g.subjects(OWL.equivalentClass, c): # c1 == c
-                eq_targetClass.add(c1)
-                for s in g.subjects(RDF.type, c1):
-                    eq_targetNodes.add(s)
-                    g.add((s, RDF.type, c))
-                for ss in g.subjects(RDF.type, c):
-                    g.add((ss, RDF.type, c1))
-                g.remove((c1, OWL.equivalentClass, c))
-                g.add((c1, RDFS.subClassOf, c))
-                g.add((c, RDFS.subClassOf, c1))
-            for c2 in g.objects(c, OWL.equivalentClass): # c == c2
-                eq_targetClass.add(c2)
-                for s in g.subjects(RDF.type, c2):
-                    eq_targetNodes.add(s)
-                    g.add((s, RDF.type, c))
-                for ss in g.subjects(RDF.type, c):
-                    g.add((ss, RDF.type, c2))
-                g.remove((c, OWL.equivalentClass, c2))
-                g.add((c2, RDFS.subClassOf, c))
-                g.add((c, RDFS.subClassOf, c2))
-            for c1 in g.subjects(OWL.sameAs, c): # c1 == c 
-                eq_targetClass.add(c1)
-                for s in g.subjects(RDF.type, c1):
-                    eq_targetNodes.add(s)
-                    g.add((s, RDF.type, c))
-                for ss in g.subjects(RDF.type, c):
-                    g.add((ss, RDF.type, c1))
-                g.remove((c1, OWL.sameAs, c))
-                g.add((c1, RDFS.subClassOf, c))
-                g.add((c, RDFS.subClassOf, c1))
-            for c2 in g.objects(c, OWL.sameAs): # c == c2
-                eq_targetClass.add(c2)
-                for s in g.subjects(RDF.type, c2):
-                    eq_targetNodes.add(s)
-                    g.add((s, RDF.type, c))
-                for ss in g.subjects(RDF.type, c):
-                    g.add((ss, RDF.type, c2))
-                g.remove((c, OWL.equivalentClass, c2))
-                g.add((c2, RDFS.subClassOf, c))
-                g.add((c, RDFS.subClassOf, c2))
+            # the whole equivalence group of c at once, every instance of one
+            # member becomes an instance of all of them (merged one pair at a
+            # time, a member merged early missed the instances of later ones)
+            axioms = [(c1, p, c) for p in CLASS_PENDING for c1 in g.subjects(p, c)]
+            axioms.extend((c, p, c2) for p in CLASS_PENDING for c2 in g.objects(c, p))
+            members = sorted(set(x if y == c else y for x, p, y in axioms))
+            typed = dict((c1, dict.fromkeys(g.subjects(RDF.type, c1))) for c1 in [c] + members)
+            instances = dict()
+            for known in typed.values():
+                instances.update(known)
+            eq_targetClass.update(members)
+            eq_targetNodes.update(instances)
+            with WriteBatch(g) as batch:
+                for c1, known in typed.items():
+                    for s in instances:
+                        if s not in known:
+                            batch.add((s, RDF.type, c1))
+                for axiom in axioms:
+                    batch.remove(axiom)
+                for c1 in members:
+                    batch.add((c1, RDFS.subClassOf, c))
+                    batch.add((c, RDFS.subClassOf, c1))
 
     
     for new_node in eq_targetNodes:
         if new_node not in found_node_targets:
-            same_set = set()
-            same_nodes.update({new_node: same_set})
+            same_nodes.add(new_node)
         
     found_node_targets.update(eq_targetNodes)
     target_classes.update(eq_targetClass)   
     
             
         
-def merge_same_property(g, properties, found_node_targets, same_nodes, target_classes):
-    for focus_property in properties:
-        check_irreflexiveProperty(g, focus_property)
-        check_asymmetricProperty(g, focus_property)
-        # subProperty TODO: generator for subProperties
-        while not all_subProperties_merged(g, focus_property):
+def merge_same_property(g, properties, found_node_targets, same_nodes, target_classes, focus_properties=None):
+    if focus_properties is None:
+        focus_properties = properties
+    for focus_property in focus_properties:
+        merge_sub_properties(g, focus_property)
+        merge_equivalent_properties(g, properties, focus_property)
+        check_symmetricProperty(g, focus_property)
+        check_transitiveProperty(g, focus_property)
+        check_inverseOf(g, focus_property)
+        check_domain_range(g, focus_property, found_node_targets, same_nodes, target_classes)
+        check_FunctionalProperty(g, focus_property)
+        check_InverseFunctionalProperty(g, focus_property)
+    #return found_node_targets    
+
+
+@rule("prp-spo1")
+def merge_sub_properties(g, focus_property):
+    # subProperty TODO: generator for subProperties
+    while not all_subProperties_merged(g, focus_property):
+        with WriteBatch(g) as batch:
             for sub_p in g.subjects(RDFS.subPropertyOf, focus_property):   
                 if (focus_property, RDFS.subPropertyOf, sub_p) in g: #scm-eqp2
-                    g.add((focus_property, OWL.sameAs, sub_p))
+                    batch.add((focus_property, OWL.sameAs, sub_p))
                 else:
                     for p3 in g.subjects(RDFS.subPropertyOf, sub_p): # RULE scm-spo
                         if focus_property != p3:
-                            g.add((p3, RDFS.subPropertyOf, focus_property))
+                            batch.add((p3, RDFS.subPropertyOf, focus_property))
                             
                     for c in g.objects(focus_property,RDFS.domain): #scm-dom2
-                        g.add((sub_p, RDFS.domain, c))
+                        batch.add((sub_p, RDFS.domain, c))
                         
                     for c1 in g.objects(focus_property,RDFS.range): #scm-rng2
-                        g.add((sub_p, RDFS.range, c1))
+                        batch.add((sub_p, RDFS.range, c1))
                         
                     for x, y in g.subject_objects(sub_p): # prp-spo1
-                        g.add((x, focus_property, y))
+                        batch.add((x, focus_property, y))
                 
-                    g.remove((sub_p, RDFS.subPropertyOf, focus_property))
-            
-        
-        while not all_property_merged(g, focus_property):
+                    batch.remove((sub_p, RDFS.subPropertyOf, focus_property))
+
+
+@rule("eq-rep-p")
+def merge_equivalent_properties(g, properties, focus_property):
+    while not all_property_merged(g, focus_property):
+        with WriteBatch(g) as batch:
             for p1 in g.subjects(OWL.equivalentProperty, focus_property):
-                g.remove((p1, OWL.equivalentProperty, focus_property))
-                g.add((focus_property, OWL.sameAs, p1))
+                batch.remove((p1, OWL.equivalentProperty, focus_property))
+                batch.add((focus_property, OWL.sameAs, p1))
             for p2 in g.objects(focus_property, OWL.equivalentProperty):
-                g.remove((focus_property, OWL.equivalentProperty, p2))
-                g.add((focus_property, OWL.sameAs, p2))
+                batch.remove((focus_property, OWL.equivalentProperty, p2))
+                batch.add((focus_property, OWL.sameAs, p2))
             
             for same_prop in g.subjects(OWL.sameAs, focus_property):                 
-                g.remove((same_prop, OWL.sameAs, focus_property))
-                g.add((focus_property, OWL.sameAs, same_prop))
-                
-            for same_property in g.objects(focus_property, OWL.sameAs):
-                check_irreflexiveProperty(g, same_property)
-                check_asymmetricProperty(g, same_property)
-                
-                if same_property != focus_property:
-                    if not same_property in properties:
-                        for p, o in g.predicate_objects(same_property):
-                            g.remove((same_property, p, o))
-                            g.add((focus_property, p, o))
-                        for s, p in g.subject_predicates(same_property):
-                            g.remove((s, p, same_property))
-                            g.add((s, p, focus_property))
-                        for s, o in g.subject_objects(same_property):
-                            g.add((s, focus_property, o))
-                            g.remove((s, same_property, o))
+                batch.remove((same_prop, OWL.sameAs, focus_property))
+                batch.add((focus_property, OWL.sameAs, same_prop))
+        
+        # the same properties that are no path property of their own are
+        # rewritten to focus_property in all three positions in one batch
+        same_properties = sorted(g.objects(focus_property, OWL.sameAs))
+        with WriteBatch(g) as batch:
+            batch.rewrite(dict((p, focus_property) for p in same_properties
+                               if p != focus_property and p not in properties), predicates=True)
+        
+        # a same property that is a path property itself keeps its triples,
+        # they are copied to focus_property; membership uses the indexes
+        with WriteBatch(g) as batch:
+            for same_property in same_properties:
+                if same_property != focus_property and same_property in properties:
+                    for s, o in g.subject_objects(same_property):
+                        if (s, focus_property, o) not in g:
+                            batch.add((s, focus_property, o))
                         
-                    else:
-                        for s, o in g.subject_objects(same_property):
-                            if not (s, focus_property, o) in g.triples():
-                                g.add((s, focus_property, o))
-                            
-                        for p, o in g.predicate_objects(same_property):
-                            if not (focus_property, p, o) in g.triples():
-                                g.add((focus_property, p, o))
-                        for s, p in g.subject_predicates(same_property):
-                            if not (s, p, focus_property) in g.triples():
-                                g.add((s, p, focus_property))
+                    for p, o in g.predicate_objects(same_property):
+                        if (focus_property, p, o) not in g:
+                            batch.add((focus_property, p, o))
+                    for s, p in g.subject_predicates(same_property):
+                        if (s, p, focus_property) not in g:
+                            batch.add((s, p, focus_property))
                     
-                g.remove((focus_property, OWL.sameAs, same_property))
+                batch.remove((focus_property, OWL.sameAs, same_property))
+
+
+def same_focus_index(g, focus_nodes, local=False):
+    index = EquivalenceIndex()
+    if local:
+        # eq-sym, eq-trans: only the sameAs components around focus_nodes
+        stack = [f for f in focus_nodes if not isinstance(f, Literal)]
+        seen = set(stack)
+        while stack:
+            x = stack.pop()
+            for y in chain(g.objects(x, OWL.sameAs), g.subjects(OWL.sameAs, x)):
+                if isinstance(y, Literal):
+                    continue
+                index.union(x, y)
+                if y not in seen:
+                    seen.add(y)
+                    stack.append(y)
+    else:
+        # eq-sym, eq-trans: one pass over all owl:sameAs pairs
+        for s, o in g.subject_objects(OWL.sameAs):
+            if isinstance(s, Literal) or isinstance(o, Literal):
+                continue
+            index.union(s, o)
+    
+    cliques = dict()
+    for f in focus_nodes:
+        if f in index:
+            root = index.find(f)
+            if root not in cliques:
+                cliques[root] = set()
+            cliques[root].add(f)
+    return index, cliques
+
+
+@rule("eq-rep-s/o")
+def merge_same_focus_nodes(g, same_nodes, focus_nodes, local=False, violations=None):
+    index, cliques = same_focus_index(g, focus_nodes, local)
+    if len(cliques) == 0:
+        return same_nodes
+    
+    members = index.classes()
+    canonical = dict()
+    chosen = []
+    for root, focus_in_clique in cliques.items():
+        # the canonical representative is a focus node, IRIs before blank nodes
+        focus = min(focus_in_clique, key=node_order)
+        same_nodes.add(focus)
+        chosen.append(focus)
+        for o in members[root]:
+            if o == focus:
+                continue
+            canonical[o] = focus
+            same_nodes.merge(focus, o)
             
-                
-        check_propertyDisjointWith(g, focus_property)
-        check_symmetricProperty(g, focus_property)
-        check_transitiveProperty(g, focus_property)
-        check_inverseOf(g, focus_property)
-        check_domain_range(g, focus_property, found_node_targets, same_nodes, target_classes)
-        check_com_dw(g, target_classes)
-        check_FunctionalProperty(g, focus_property)
-        check_InverseFunctionalProperty(g, focus_property)
-    #return found_node_targets    
+    for x in canonical: # eq-diff1
+        for y in g.objects(x, OWL.differentFrom):
+            if canonical.get(y, y) == canonical[x]:
+                check_eq_diff_erro(g, x, y, violations)
+        for y in g.subjects(OWL.differentFrom, x):
+            if canonical.get(y, y) == canonical[x]:
+                check_eq_diff_erro(g, y, x, violations)
+    
+    with WriteBatch(g) as batch:
+        batch.rewrite(canonical) # eq-rep-s, eq-rep-o
+        for focus in chosen: # also a clique of one, (f owl:sameAs f) only
+            batch.remove((focus, OWL.sameAs, focus))
+    return same_nodes
 
 
 def merge_same_focus(g, same_nodes, focus):
-    #eq-sym
-    for s in g.subjects(OWL.sameAs, focus): # s = focus node
-        check_eq_diff_erro(g, s, focus)
-        if s != focus:
-            g.remove((s, OWL.sameAs, focus))
-            g.add((focus, OWL.sameAs, s)) # s = focus --> focus = s
-                            
-    
-    for o in g.objects(focus, OWL.sameAs):   #focus node = o
-        check_eq_diff_erro(g, focus, o)
-        if o != focus:  
-            same_set = same_nodes[focus]
-            same_set.add(o)
-            if o in same_nodes:
-                del same_nodes[o]
-            # for "eq-trans", "eq-rep-s", "eq-rep-o"
-            for pp, oo in g.predicate_objects(o): # o pp oo --> focus pp oo
-                g.remove((o, pp, oo))  
-                g.add((focus, pp, oo))
-                '''
-                if not isinstance(oo, BNode):
-                    g.add((focus, pp, oo))
-                else:
-                    for bn in g.objects(focus, pp):
-                        if isinstance(bn, BNode):
-                            g.add((focus, pp, oo))
-                '''
-            for ss, pp in g.subject_predicates(o): # ss pp o --> ss pp fucus
-                g.remove((ss, pp, o))
-                g.add((ss, pp, focus))
-                
-        if o == focus:
-            g.remove((focus, OWL.sameAs, focus))
+    return merge_same_focus_nodes(g, same_nodes, [focus])
          
 
 def noiseless_fused_graph(
@@ -538,83 +844,422 @@ def noiseless_fused_graph(
     data_graph_format: Optional[str] = None,
     shacl_graph_format: Optional[str] = None,
     merge_Type: bool=True,
+    semi_naive: bool=False,
+    streaming: bool=False,
+    backend: str="rdflib",
+    stats: Optional[dict] = None,
+    profile: bool=False,
+    plan_cache: Optional[str] = None,
+    violations: Optional[list] = None,
+    view: bool=False,
+    store: Optional[Union[Store, str]] = None,
+    cache: Optional[Union[FusionCache, str]] = None,
+    destination: Optional[Union[str, IO]] = None,
+    compress: Optional[bool] = None,
     ):
     
-    shapes, named_graphs = load_graph( data_graph, shacl_graph, data_graph_format,shacl_graph_format)    
+    # results are only cached for plain in-memory runs
+    cache = fusion_cache_of(cache) if not (profile or view or violations is not None or store is not None
+                                           or destination is not None) else None
+    key = None
+    if cache is not None:
+        key = cache.key(data_graph, data_graph_format, shacl_graph, shacl_graph_format,
+                        noiseless=True, merge_Type=merge_Type, semi_naive=semi_naive, streaming=streaming, backend=backend)
+        cached = None if key is None else cache.get(key)
+        if cached is not None:
+            return cached
+    
+    plan, named_graphs = load_graph( data_graph, shacl_graph, data_graph_format,shacl_graph_format, streaming, plan_cache, store)    
 
+    fusion_profile = profiling.FusionProfile() if profile else None
+    with profiling.recording(fusion_profile):
+        for g in named_graphs:
+            vg = g 
+            same_nodes, found_node_targets, target_classes, global_path = fuse_named_graph(
+                vg, plan, semi_naive, backend, stats, violations)
+            if view or destination is not None:
+                # read-only, filtered on the fly, merge_Type does not matter
+                vg = noiseless_view(vg, found_node_targets, target_classes, global_path)
+            else:
+                vg = remove_noise(vg, found_node_targets, target_classes, global_path, merge_Type)
+            if destination is not None:
+                # the retained triples are written as the view yields them
+                write_ntriples(vg.triples((None, None, None)), destination, compress)
+            if profile:
+                return vg, same_nodes, fusion_profile
+            if key is not None:
+                cache.put(key, vg, same_nodes)
+            return vg, same_nodes
+
+
+def remove_noise(vg, found_node_targets, target_classes, global_path, merge_Type=True):
+    # keeps every triple of a focus node or target class, and the triples
+    # of a global path property with any subject
+    keep = found_node_targets.union(target_classes)
+    if merge_Type:
+        path_subjects = set(s for p in global_path for s in vg.subjects(p, unique=True))
+        for s in set(vg.subjects(unique=True)).difference(keep):
+            if s in path_subjects:
+                for p in set(vg.predicates(s, unique=True)).difference(global_path):
+                    vg.remove((s, p, None))
+            else:
+                vg.remove((s, None, None))
+        vg.store.commit()
+        return vg
+    else:
+        rg = rdflib.Graph()
+        for p, n in vg.namespace_manager.namespaces():
+            rg.namespace_manager.bind(p, n)
+        
+        rg.addN((s, pp, oo, rg) for s in keep for pp, oo in vg.predicate_objects(s))
+        rg.addN((ss, p, oo, rg) for p in global_path for ss, oo in vg.subject_objects(p) if ss not in keep)
+        return rg
+
+
+def fuse_and_validate(
+    data_graph: Union[GraphLike, str, bytes],
+    shacl_graph: Optional[Union[GraphLike, str, bytes]] = None,
+    data_graph_format: Optional[str] = None,
+    shacl_graph_format: Optional[str] = None,
+    noiseless: bool=False,
+    semi_naive: bool=False,
+    streaming: bool=False,
+    backend: str="rdflib",
+    plan_cache: Optional[str] = None,
+    validation_options: Optional[dict] = None,
+    ):
+    # Fuses and validates with one parse of the shapes: the plan's shapes
+    # graph is handed to pyshacl, which validates the fused graph in place.
+    # pyshacl harvests the shapes itself, so that options like debug and
+    # use_js set them up. A noiseless result is the filtered view, not a copy.
+    # Returns conforms, report graph, report text, same_nodes and the
+    # seconds spent per phase.
+    timings = dict()
+    start = time.perf_counter()
+    plan, named_graphs = load_graph(data_graph, shacl_graph, data_graph_format, shacl_graph_format, streaming,
+                                    plan_cache)
+    timings["load"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
     for g in named_graphs:
-        vg = g 
-        found_node_targets = set()
-        target_classes = set()
-        path_value = set()
-        global_path = set()
-        found_target_classes = set()
-        for s in shapes:
-            focus = s.focus_nodes(vg)
-            found_node_targets.update(focus)
-            target_classes.update(s.target_classes())
-            target_classes.update(s.implicit_class_targets())
-            
-            target_property=set(s.property_shapes())
+        vg = g
+        same_nodes, found_node_targets, target_classes, global_path = fuse_named_graph(
+            vg, plan, semi_naive, backend)
+    if noiseless:
+        vg = noiseless_view(vg, found_node_targets, target_classes, global_path)
+    timings["fusion"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    apply_patches()
+    assign_baked_in()
+    options = dict(validation_options or {})
+    options.setdefault("inference", "none")
+    options["inplace"] = True
+    validator = Validator(DataGraph.from_rdflib(vg), shacl_graph=plan.graph(), options=options)
+    conforms, report_graph, report_text = validator.run()
+    timings["validation"] = time.perf_counter() - start
+    return conforms, report_graph, report_text, same_nodes, timings
 
-            if len(set(s.target_classes()))==0:       
-                for blin in target_property:
-                    global_path.update(s.sg.graph.objects(blin, SH_path))
 
-            for blin in target_property:
-                path_value.update(s.sg.graph.objects(blin, SH_path))
+# the FusionPlan of the pool worker, set once per process by init_fusion_worker
+worker_plan = None
 
-        for tc in target_classes:
-            subc = vg.transitive_subjects(RDFS_subClassOf, tc)
-            for subclass in subc:
-                if subclass == tc:
-                    continue
-                found_target_classes.add(subclass)
-        target_classes.update(found_target_classes)
-        
-        
-        same_nodes = dict()
-        for f in found_node_targets:
-            same_set = set()
-            same_nodes.update({f: same_set})
-        
-        while (not all_targetClasses_merged(vg, target_classes)) or (not all_samePath_merged(vg, path_value)):
-            
-            merge_target_classes(vg, found_node_targets, same_nodes, target_classes)
-            target_domain_range(vg, found_node_targets, same_nodes, target_classes)
-            
-            # merge same properties 
-            merge_same_property(vg, path_value, found_node_targets, same_nodes, target_classes)
-            
-            # merge same nodes
-            for focus_node in found_node_targets:      
-                while not all_focus_merged(vg, focus_node):
-                    merge_same_focus(vg, same_nodes, focus_node)  
-                    check_com_dw(vg, target_classes)
 
-        
-        if merge_Type:
-            for s, p, o in vg:
-                if not p in global_path and (not s in found_node_targets.union(target_classes)):
-                    vg.remove((s,p,o))
-            return vg, same_nodes
-        else:
-            rg = rdflib.Graph()
-            for p, n in vg.namespace_manager.namespaces():
-                rg.namespace_manager.bind(p, n)
-            
+def init_fusion_worker(plan):
+    global worker_plan
+    worker_plan = plan
 
-            for s in found_node_targets.union(target_classes):
-                for pp, oo in vg.predicate_objects(s):
-                    rg.add((s, pp, oo))
-            for p in global_path:
-                for ss, oo in vg.subject_objects(p):
-                    if not ss in found_node_targets.union(target_classes):
-                        rg.add((ss, p, oo))
-            return rg, same_nodes
+
+def fusion_worker(identifier, triples, namespaces, options):
+    vg = rdflib.Graph(identifier=identifier)
+    for prefix, ns in namespaces:
+        vg.namespace_manager.bind(prefix, ns, override=True, replace=True)
+    vg.addN((s, p, o, vg) for s, p, o in triples)
+    same_nodes, found_node_targets, target_classes, global_path = fuse_named_graph(
+        vg, worker_plan, options["semi_naive"], options["backend"])
+    if options["noiseless"]:
+        vg = remove_noise(vg, found_node_targets, target_classes, global_path, options["merge_Type"])
+    return identifier, list(vg), list(vg.namespace_manager.namespaces()), same_nodes
+
+
+def parallel_fused_graph(
+    data_graph: Union[GraphLike, str, bytes],
+    shacl_graph: Optional[Union[GraphLike, str, bytes]] = None,
+    data_graph_format: Optional[str] = None,
+    shacl_graph_format: Optional[str] = None,
+    workers: Optional[int] = None,
+    noiseless: bool=False,
+    merge_Type: bool=True,
+    semi_naive: bool=False,
+    backend: str="rdflib",
+    plan_cache: Optional[str] = None,
+    ):
+    # fuses every named graph in its own process, returns {identifier: (graph, same_nodes)}
+    from concurrent.futures import ProcessPoolExecutor
+    
+    plan = load_plan(shacl_graph, shacl_graph_format, plan_cache)
+    loaded_dg = load_from_source(data_graph, rdf_format=data_graph_format, multigraph=True, do_owl_imports=False)
+    if not isinstance(loaded_dg, rdflib.Graph):
+        raise RuntimeError("data_graph must be a rdflib Graph object")
+    
+    options = {"noiseless": noiseless, "merge_Type": merge_Type, "semi_naive": semi_naive, "backend": backend}
+    results = dict()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_fusion_worker,
+                             initargs=(plan,)) as pool:
+        namespaces = list(loaded_dg.namespace_manager.namespaces())
+        futures = [
+            pool.submit(fusion_worker, g.identifier, list(g.triples((None, None, None))), namespaces, options)
+            for g in named_graphs_of(loaded_dg)
+        ]
+        for future in futures:
+            identifier, triples, graph_namespaces, same_nodes = future.result()
+            vg = rdflib.Graph(identifier=identifier)
+            for prefix, ns in graph_namespaces:
+                vg.namespace_manager.bind(prefix, ns, override=True, replace=True)
+            vg.addN((s, p, o, vg) for s, p, o in triples)
+            results[identifier] = (vg, same_nodes)
+    return results
+
+
+def sharded_fused_graph(
+    data_graph: Union[GraphLike, str, bytes],
+    shacl_graph: Optional[Union[GraphLike, str, bytes]] = None,
+    data_graph_format: Optional[str] = None,
+    shacl_graph_format: Optional[str] = None,
+    workers: Optional[int] = None,
+    shards: Optional[int] = None,
+    noiseless: bool=False,
+    merge_Type: bool=True,
+    semi_naive: bool=False,
+    backend: str="rdflib",
+    plan_cache: Optional[str] = None,
+    ):
+    # Fuses one data graph on several processes: the ABox is split into the
+    # components no rule can cross (see sharding.components), packed into
+    # shards, and every shard is fused together with a copy of the TBox.
+    # Returns the union of the shards and their merged same_nodes.
+    from concurrent.futures import ProcessPoolExecutor
+    
+    plan = load_plan(shacl_graph, shacl_graph_format, plan_cache)
+    loaded_dg = load_from_source(data_graph, rdf_format=data_graph_format, multigraph=True, do_owl_imports=False)
+    if not isinstance(loaded_dg, rdflib.Graph):
+        raise RuntimeError("data_graph must be a rdflib Graph object")
+    named_graphs = named_graphs_of(loaded_dg)
+    if len(named_graphs) != 1:
+        raise RuntimeError("sharded_fused_graph needs a single data graph, got %d named graphs" % len(named_graphs))
+    g = named_graphs[0]
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if shards is None:
+        shards = workers
+    target_classes = plan.targets(g)[1]
+    tbox, parts = components(g, SCHEMA_TERMS, target_classes, plan.target_objects_of)
+    if plan.advanced:
+        # SPARQL targets can select focus nodes across components
+        shards = 1
+    
+    options = {"noiseless": noiseless, "merge_Type": merge_Type, "semi_naive": semi_naive, "backend": backend}
+    namespaces = list(g.namespace_manager.namespaces())
+    vg = rdflib.Graph(identifier=g.identifier)
+    for prefix, ns in namespaces:
+        vg.namespace_manager.bind(prefix, ns, override=True, replace=True)
+    same_nodes = SameNodes()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_fusion_worker,
+                             initargs=(plan,)) as pool:
+        futures = [
+            pool.submit(fusion_worker, g.identifier, tbox + shard, namespaces, options)
+            for shard in shards_of(parts, shards)
+        ]
+        for future in futures:
+            identifier, triples, graph_namespaces, shard_same_nodes = future.result()
+            vg.addN((s, p, o, vg) for s, p, o in triples)
+            for focus, aliases in shard_same_nodes.items():
+                same_nodes.add(focus)
+                for alias in aliases:
+                    same_nodes.merge(focus, alias)
+    return vg, same_nodes
             
             
             
           
  
-  
\ No newline at end of file
+  
+
+
+class FusedGraph:
+    # Keeps the asserted triples next to the fused graph so that small updates
+    # can be applied without refusing everything. add() runs the semi-naive
+    # fixpoint on the new triples only; remove() follows DRed: it overdeletes
+    # the fused triples around the removed ones (their sameAs cliques and
+    # transitive predecessors) and rederives that region from the asserted
+    # triples. Removing schema triples falls back to refuse().
+    # Built, or after refuse(), the graph is the one fused_graph gives. After
+    # add() or remove() it is only guaranteed that every asserted triple,
+    # except the sameAs, equivalentClass, equivalentProperty and
+    # subPropertyOf axioms fusion consumes, is in the graph with its subject
+    # and object replaced by their focus nodes, and that no alias is left in
+    # the graph. It can differ from refusing: the rules consume the
+    # equivalence axioms in the order they find them, so which triples an
+    # update derives depends on what was fused before. Call refuse() for the
+    # exact graph.
+
+    def __init__(
+        self,
+        data_graph: Union[GraphLike, str, bytes],
+        shacl_graph: Optional[Union[GraphLike, str, bytes]] = None,
+        data_graph_format: Optional[str] = None,
+        shacl_graph_format: Optional[str] = None,
+        semi_naive: bool=False,
+        streaming: bool=False,
+        plan_cache: Optional[str] = None,
+        ):
+        plan, named_graphs = load_graph(data_graph, shacl_graph, data_graph_format, shacl_graph_format, streaming,
+                                        plan_cache)
+        if len(named_graphs) != 1:
+            raise RuntimeError("FusedGraph needs a single data graph, got %d named graphs" % len(named_graphs))
+        self.plan = plan
+        self.graph = named_graphs[0]
+        self.asserted = rdflib.Graph()
+        self.asserted += self.graph
+        
+        self.node_targets = plan.target_nodes
+        self.subject_target_properties = plan.target_subjects_of
+        self.object_target_properties = plan.target_objects_of
+        self.semi_naive = semi_naive
+        self._fuse()
+    
+    def _fuse(self):
+        self.found_node_targets, self.target_classes, self.path_value, self.global_path = self.plan.targets(
+            self.graph)
+        self.same_nodes = SameNodes(self.found_node_targets)
+        # kept for the updates, which only check what they touch
+        self.checks = ConsistencyChecks()
+        fixpoint(self.graph, self.found_node_targets, self.same_nodes, self.target_classes, self.path_value,
+                 self.semi_naive, checks=self.checks)
+    
+    def _alias(self, x):
+        return self.same_nodes.canonical(x, x)
+    
+    def _canonical(self, triple):
+        s, p, o = triple
+        return (self._alias(s), p, self._alias(o))
+    
+    def _add_focus(self, x):
+        if x not in self.found_node_targets:
+            self.found_node_targets.add(x)
+            self.same_nodes.add(x)
+    
+    def _add_targets(self, triple):
+        s, p, o = triple
+        if p == RDF.type and o in self.target_classes:
+            self._add_focus(s)
+        if p == RDFS.subClassOf and o in self.target_classes:
+            for c in self.graph.transitive_subjects(RDFS.subClassOf, s):
+                if c not in self.target_classes:
+                    self.target_classes.add(c)
+                    for x in self.graph.subjects(RDF.type, c):
+                        self._add_focus(x)
+        if p in self.subject_target_properties:
+            self._add_focus(s)
+        if p in self.object_target_properties:
+            self._add_focus(o)
+    
+    def _insert(self, triples, delta):
+        for t in triples:
+            if t[1] == OWL.differentFrom and self._alias(t[0]) == self._alias(t[2]): # eq-diff1
+                check_eq_diff_erro(self.asserted, t[0], t[2])
+            t = self._canonical(t)
+            if t not in self.graph:
+                self.graph.add(t)
+                delta.add(t)
+            self._add_targets(t)
+    
+    def _asserted_schema(self, delta):
+        # the rules consume equivalence and subproperty triples while merging,
+        # so they are replayed from the asserted graph for the touched terms
+        terms = set()
+        for s, p, o in delta:
+            terms.add(p)
+            if p == RDF.type:
+                terms.add(o)
+        schema = set()
+        for t in terms:
+            for pred in (OWL.equivalentClass, OWL.equivalentProperty, OWL.sameAs):
+                schema.update(self.asserted.triples((t, pred, None)))
+                schema.update(self.asserted.triples((None, pred, t)))
+            schema.update(self.asserted.triples((t, RDFS.subPropertyOf, None)))
+        return schema
+    
+    def _is_schema(self, triple):
+        s, p, o = triple
+        if p in SCHEMA_TERMS:
+            return True
+        if p == RDF.type and o in PROPERTY_CHARACTERISTICS:
+            return True
+        if p == OWL.sameAs:
+            terms = self.path_value.union(self.target_classes)
+            return s in terms or o in terms
+        return False
+    
+    def _rederive(self, delta):
+        self._insert(self._asserted_schema(delta), delta)
+        seminaive_fixpoint(self.graph, self.found_node_targets, self.same_nodes, self.target_classes,
+                           self.path_value, delta, checks=self.checks)
+    
+    def add(self, triples):
+        triples = list(triples)
+        for t in triples:
+            self.asserted.add(t)
+        delta = set()
+        self._insert(triples, delta)
+        if len(delta) != 0:
+            self._rederive(delta)
+        return self
+    
+    def remove(self, triples):
+        triples = [t for t in triples if t in self.asserted]
+        for t in triples:
+            self.asserted.remove(t)
+        if len(triples) == 0:
+            return self
+        if any(self._is_schema(t) for t in triples):
+            return self.refuse()
+        
+        # overdelete
+        region = set()
+        for s, p, o in triples:
+            s, p, o = self._canonical((s, p, o))
+            region.add(s)
+            if not isinstance(o, Literal):
+                region.add(o)
+            if (p, RDF.type, OWL.TransitiveProperty) in self.graph: # prp-trp
+                region.update(self.graph.subjects(p, s))
+        members = set()
+        for k in region:
+            members.add(k)
+            members.update(self.same_nodes.get(k, ()))
+        for k in region:
+            for t in list(self.graph.triples((k, None, None))):
+                self.graph.remove(t)
+            for t in list(self.graph.triples((None, None, k))):
+                self.graph.remove(t)
+        for x in members:
+            self.same_nodes.pop(x, None)
+            self.found_node_targets.discard(x)
+        
+        # rederive
+        delta = set()
+        for x in members:
+            if x in self.node_targets:
+                self._add_focus(x)
+            self._insert(chain(self.asserted.triples((x, None, None)), self.asserted.triples((None, None, x))),
+                         delta)
+        self._rederive(delta)
+        return self
+    
+    def refuse(self):
+        self.graph.remove((None, None, None))
+        self.graph += self.asserted
+        self._fuse()
+        return self
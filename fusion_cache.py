@@ -0,0 +1,102 @@
+import gc
+import hashlib
+import os
+import pickle
+
+import rdflib
+
+from plan import FusionPlan, shapes_digest, source_digest
+
+# bump when the pickled layout of a cached result changes, old files are ignored then
+CACHE_VERSION = 3
+
+# default bound of a cache directory, the least recently used results go first
+CACHE_BYTES = 1 << 30
+
+
+class FusionCache:
+    # Fused graphs and their same_nodes on disk, one file per
+    # (data graph, shapes graph, options) digest. The in-memory store is
+    # pickled with its indexes, so a hit does not add a single triple. A hit
+    # touches the file, so the modification times order the entries for
+    # the LRU eviction.
+
+    def __init__(self, directory, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data_graph, data_graph_format, shacl_graph, shacl_graph_format, **options):
+        if isinstance(shacl_graph, FusionPlan):
+            if shacl_graph.digest is None:
+                return None
+            shapes = shacl_graph.digest
+        else:
+            shapes = shapes_digest(shacl_graph, shacl_graph_format)
+        h = hashlib.sha256(("%d\n" % CACHE_VERSION).encode())
+        h.update(source_digest(data_graph, data_graph_format, CACHE_VERSION).encode())
+        h.update(shapes.encode())
+        h.update(repr(sorted(options.items())).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".fused")
+
+    def get(self, key):
+        path = self.path(key)
+        # the store unpickles into many small containers, the collector
+        # would walk all of them again and again
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, "rb") as f:
+                version, identifier, store, same_nodes = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        finally:
+            if collecting:
+                gc.enable()
+        if version != CACHE_VERSION:
+            return None
+        return rdflib.Graph(store=store, identifier=identifier), same_nodes
+
+    def put(self, key, vg, same_nodes):
+        path = self.path(key)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        # a store of its own, vg may share one with other named graphs
+        g = rdflib.Graph(identifier=vg.identifier)
+        for prefix, ns in vg.namespace_manager.namespaces():
+            g.namespace_manager.bind(prefix, ns, override=True, replace=True)
+        g.addN((s, p, o, g) for s, p, o in vg.triples((None, None, None)))
+        entry = (CACHE_VERSION, g.identifier, g.store, same_nodes)
+        with open(tmp, "wb") as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".fused"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError: # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def fusion_cache_of(cache):
+    # cache is a FusionCache, a directory, or None
+    if cache is None or isinstance(cache, FusionCache):
+        return cache
+    return FusionCache(cache)
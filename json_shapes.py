@@ -0,0 +1,127 @@
+import json
+import os
+
+from rdflib import BNode, Literal, Namespace, URIRef
+from rdflib.namespace import RDF, SH, XSD
+
+from plan import FusionPlan
+
+# IRIs of the shapes, which the JSON format only names
+JSON_SHAPE = Namespace("urn:json-shape:")
+
+
+def read_json_shapes(source):
+    # the shapes of a directory of JSON files, or of one file
+    if os.path.isdir(source):
+        files = [os.path.join(source, name) for name in sorted(os.listdir(source)) if name.endswith(".json")]
+    else:
+        files = [source]
+    shapes = []
+    for name in files:
+        with open(name, encoding="utf-8") as f:
+            shapes.append(json.load(f))
+    return shapes
+
+
+def expand(term, prefixes):
+    # ub:name, <http://...> and ^ub:name (inverse) to (IRI, inverse)
+    inverse = term.startswith("^")
+    if inverse:
+        term = term[1:]
+    if term.startswith("<") and term.endswith(">"):
+        return URIRef(term[1:-1]), inverse
+    prefix, colon, local = term.partition(":")
+    if colon == "" or prefix not in prefixes:
+        raise RuntimeError("Unknown prefix in %s" % term)
+    return URIRef(prefixes[prefix] + local), inverse
+
+
+def rdf_list(triples, members):
+    head = RDF.nil
+    for member in reversed(members):
+        node = BNode()
+        triples.append((node, RDF.first, member))
+        triples.append((node, RDF.rest, head))
+        head = node
+    return head
+
+
+def json_plan(source, digest=None):
+    # Compiles JSON shapes straight into a FusionPlan: targetDef.class gives
+    # the target classes, the paths of the shapes reachable from a
+    # targeted one over "shape" references give path_value. The SHACL
+    # triples are only kept for plan.graph(), nothing is harvested.
+    # A constraint with a "shape" counts the values conforming to it
+    # (qualified min / max count), several conjunctions are an sh:or.
+    plan = FusionPlan(digest=digest)
+    shapes = read_json_shapes(source)
+    names = set(shape["name"] for shape in shapes)
+    namespaces = dict()
+    triples = []
+    paths = dict()
+    references = dict()
+    roots = []
+    for shape in shapes:
+        name = shape["name"]
+        node = JSON_SHAPE[name]
+        prefixes = dict((p, ns.strip("<>")) for p, ns in shape.get("prefix", {}).items())
+        namespaces.update(prefixes)
+        paths[name] = set()
+        references[name] = set()
+        triples.append((node, RDF.type, SH.NodeShape))
+
+        target = shape.get("targetDef", {}).get("class")
+        if target is not None:
+            target_class = expand(target, prefixes)[0]
+            plan.target_classes.add(target_class)
+            triples.append((node, SH.targetClass, target_class))
+            roots.append(name)
+
+        conjunctions = shape.get("constraintDef", {}).get("conjunctions", [])
+        if len(conjunctions) == 1:
+            holders = [node]
+        else:
+            holders = [BNode() for conjunction in conjunctions]
+            triples.append((node, SH["or"], rdf_list(triples, holders)))
+        for holder, conjunction in zip(holders, conjunctions):
+            for constraint in conjunction:
+                predicate, inverse = expand(constraint["path"], prefixes)
+                paths[name].add(predicate)
+                property_shape = BNode()
+                triples.append((holder, SH.property, property_shape))
+                if inverse:
+                    path = BNode()
+                    triples.append((path, SH.inversePath, predicate))
+                else:
+                    path = predicate
+                triples.append((property_shape, SH.path, path))
+                if "shape" in constraint:
+                    if constraint["shape"] not in names:
+                        raise RuntimeError("Shape %s references unknown shape %s" % (name, constraint["shape"]))
+                    references[name].add(constraint["shape"])
+                    triples.append((property_shape, SH.qualifiedValueShape, JSON_SHAPE[constraint["shape"]]))
+                    counts = (("min", SH.qualifiedMinCount), ("max", SH.qualifiedMaxCount))
+                else:
+                    counts = (("min", SH.minCount), ("max", SH.maxCount))
+                for key, count in counts:
+                    if key in constraint:
+                        triples.append((property_shape, count, Literal(constraint[key], datatype=XSD.integer)))
+
+        if target is None:
+            plan.global_path.update(paths[name])
+
+    # only properties some targeted shape can observe are reasoned on
+    seen = set(roots)
+    work = list(roots)
+    while len(work) != 0:
+        name = work.pop()
+        plan.path_value.update(paths[name])
+        for referenced in references[name]:
+            if referenced not in seen:
+                seen.add(referenced)
+                work.append(referenced)
+
+    plan.shape_triples = triples
+    plan.namespaces = [(p, URIRef(ns)) for p, ns in sorted(namespaces.items())]
+    plan.namespaces.append(("sh", URIRef(str(SH))))
+    return plan
@@ -0,0 +1,62 @@
+import gzip
+import io
+
+from rdflib import Literal
+
+
+def open_output(destination, compress=None):
+    # a binary stream for a file name or a stream, gzip for compress=True
+    # or a file name ending in .gz; returns (stream, close it afterwards)
+    if isinstance(destination, str):
+        if compress is None:
+            compress = destination.endswith(".gz")
+        if compress:
+            return gzip.open(destination, "wb"), True
+        return open(destination, "wb"), True
+    if isinstance(destination, io.TextIOBase):
+        if not hasattr(destination, "buffer"):
+            raise RuntimeError("N-Triples are written to a file name or a binary stream")
+        destination.flush()
+        destination = destination.buffer
+    if compress:
+        return gzip.GzipFile(fileobj=destination, mode="wb"), True
+    return destination, False
+
+
+def nt_term(term):
+    # IRIs and blank nodes as in N3; a literal is quoted on one line, N3
+    # would use triple quotes for a value with line breaks
+    if not isinstance(term, Literal):
+        return term.n3()
+    value = '"%s"' % str(term).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"').replace("\r", "\\r")
+    if term.language:
+        return "%s@%s" % (value, term.language)
+    if term.datatype:
+        return "%s^^<%s>" % (value, term.datatype)
+    return value
+
+
+def nt_row(triple):
+    return "%s %s %s .\n" % (nt_term(triple[0]), nt_term(triple[1]), nt_term(triple[2]))
+
+
+def write_ntriples(triples, destination, compress=None, batch_size=10000):
+    # Writes the triples as N-Triples while they are produced, a batch of
+    # lines at a time; nothing else is held in memory. Returns the number
+    # of triples written.
+    stream, close = open_output(destination, compress)
+    n = 0
+    try:
+        lines = []
+        for triple in triples:
+            lines.append(nt_row(triple))
+            if len(lines) == batch_size:
+                stream.write("".join(lines).encode("utf-8"))
+                n += len(lines)
+                lines = []
+        stream.write("".join(lines).encode("utf-8"))
+        n += len(lines)
+    finally:
+        if close:
+            stream.close() # a GzipFile on a caller's stream only writes its trailer
+    return n
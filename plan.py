@@ -0,0 +1,260 @@
+import hashlib
+import os
+import pickle
+
+import rdflib
+from rdflib.collection import Collection
+from rdflib.compare import to_isomorphic
+from rdflib.namespace import SH
+
+from pyshacl.consts import RDF_first, RDF_type, RDFS_subClassOf, SH_path
+from pyshacl.monkey import rdflib_bool_patch, rdflib_bool_unpatch
+from pyshacl.rdfutil import load_from_source
+from pyshacl.shapes_graph import ShapesGraph
+
+# bump when the pickled layout of FusionPlan changes, old cache files are ignored then
+PLAN_VERSION = 3
+
+# plans compiled in this process, by digest, least recently used first
+compiled_plans = dict()
+COMPILED_PLANS_SIZE = 16
+
+
+def load_shacl_graph(shacl_graph, shacl_graph_format=None):
+    if shacl_graph is not None:
+        rdflib_bool_patch()
+        loaded_sg = load_from_source(
+            shacl_graph, rdf_format=shacl_graph_format, multigraph=True, do_owl_imports=False)
+        rdflib_bool_unpatch()
+    else:
+        loaded_sg = None
+
+    assert isinstance(loaded_sg, rdflib.Graph), "shacl_graph must be a rdflib Graph object"
+    return loaded_sg
+
+
+# predicates from a shape to the shapes it validates the focus or value nodes against
+SHAPE_REFERENCES = (SH.property, SH.node, SH["not"], SH.qualifiedValueShape)
+SHAPE_LIST_REFERENCES = (SH["and"], SH["or"], SH.xone)
+PATH_WRAPPERS = (SH.inversePath, SH.zeroOrMorePath, SH.oneOrMorePath, SH.zeroOrOnePath)
+
+
+def path_predicates(sg, path):
+    # the predicates a property path walks: inverse, alternative, sequence
+    # and */+/? paths are taken apart
+    predicates = set()
+    work = [path]
+    seen = set()
+    while len(work) != 0:
+        path = work.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        if isinstance(path, rdflib.URIRef):
+            predicates.add(path)
+            continue
+        wrapped = [p for w in PATH_WRAPPERS for p in sg.objects(path, w)]
+        wrapped.extend(Collection(sg, a) for a in sg.objects(path, SH.alternativePath))
+        if len(wrapped) == 0 and (path, RDF_first, None) in sg: # sequence path
+            wrapped.append(Collection(sg, path))
+        for p in wrapped:
+            if isinstance(p, Collection):
+                work.extend(p)
+            else:
+                work.append(p)
+    return predicates
+
+
+def shape_dependencies(sg, roots):
+    # The properties observable from the shapes in roots: the paths of
+    # every shape reachable over sh:property, sh:node, sh:not,
+    # sh:qualifiedValueShape and the sh:and / sh:or / sh:xone lists.
+    properties = set()
+    seen = set(roots)
+    work = list(roots)
+    while len(work) != 0:
+        shape = work.pop()
+        for path in sg.objects(shape, SH_path):
+            properties.update(path_predicates(sg, path))
+        referenced = [s for r in SHAPE_REFERENCES for s in sg.objects(shape, r)]
+        for r in SHAPE_LIST_REFERENCES:
+            for members in sg.objects(shape, r):
+                referenced.extend(Collection(sg, members))
+        for s in referenced:
+            if s not in seen:
+                seen.add(s)
+                work.append(s)
+    return properties
+
+
+class FusionPlan:
+    # Everything the fusion reads from a shapes graph, compiled once and
+    # reusable for any number of data graphs. Only plain sets of terms are
+    # kept, so a plan pickles; the pyshacl shapes are harvested again from
+    # the stored triples when a shape has SPARQL / JS targets. Without a
+    # shapes graph the plan starts empty, for compilers of other shape
+    # formats (json_shapes) to fill in.
+
+    def __init__(self, loaded_sg=None, digest=None):
+        self.digest = digest
+        self.shape_triples = []
+        self.namespaces = []
+        self.target_nodes = set()
+        self.target_classes = set()
+        self.target_subjects_of = set()
+        self.target_objects_of = set()
+        self.path_value = set()
+        self.global_path = set()
+        self.advanced = False
+        self._graph = loaded_sg
+        self._shapes_graph = None
+        self._shapes = None
+        if loaded_sg is None:
+            return
+        self.shape_triples = list(loaded_sg.triples((None, None, None)))
+        self.namespaces = list(loaded_sg.namespace_manager.namespaces())
+        self._shapes = self.shapes_graph().shapes
+        roots = []
+        for s in self._shapes:
+            targets = set(s.target_nodes())
+            targets.update(s.target_classes())
+            targets.update(s.implicit_class_targets())
+            targets.update(s.target_subjects_of())
+            targets.update(s.target_objects_of())
+            self.target_nodes.update(s.target_nodes())
+            self.target_classes.update(s.target_classes())
+            self.target_classes.update(s.implicit_class_targets())
+            self.target_subjects_of.update(s.target_subjects_of())
+            self.target_objects_of.update(s.target_objects_of())
+            self.advanced = self.advanced or bool(s._advanced)
+            if len(targets) != 0 or s._advanced:
+                roots.append(s.node)
+
+            if len(set(s.target_classes())) == 0:
+                for blin in s.property_shapes():
+                    self.global_path.update(s.sg.graph.objects(blin, SH_path))
+        # only properties some targeted shape can observe are reasoned on
+        self.path_value = shape_dependencies(loaded_sg, roots)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_graph"] = None
+        state["_shapes_graph"] = None
+        state["_shapes"] = None
+        return state
+
+    def graph(self):
+        if self._graph is None:
+            self._graph = rdflib.Graph()
+            for prefix, ns in self.namespaces:
+                self._graph.namespace_manager.bind(prefix, ns, override=True, replace=True)
+            self._graph.addN((s, p, o, self._graph) for s, p, o in self.shape_triples)
+        return self._graph
+
+    def shapes_graph(self):
+        # the harvested pyshacl ShapesGraph
+        if self._shapes_graph is None:
+            self._shapes_graph = ShapesGraph(self.graph(), None)
+        return self._shapes_graph
+
+    def shapes(self):
+        if self._shapes is None:
+            self._shapes = self.shapes_graph().shapes
+        return self._shapes
+
+    def targets(self, vg):
+        # same as focus_nodes() of all shapes together, plus the subclass
+        # closure of the target classes in vg
+        target_classes = set(self.target_classes)
+        for tc in self.target_classes:
+            for subclass in vg.transitive_subjects(RDFS_subClassOf, tc):
+                if subclass == tc:
+                    continue
+                target_classes.add(subclass)
+
+        if self.advanced:
+            found_node_targets = set()
+            for s in self.shapes():
+                found_node_targets.update(s.focus_nodes(vg))
+        else:
+            found_node_targets = set(self.target_nodes)
+            for tc in target_classes:
+                found_node_targets.update(vg.subjects(RDF_type, tc))
+            for p in self.target_subjects_of:
+                found_node_targets.update(s for s, o in vg.subject_objects(p))
+            for p in self.target_objects_of:
+                found_node_targets.update(o for s, o in vg.subject_objects(p))
+        return found_node_targets, target_classes, set(self.path_value), set(self.global_path)
+
+    def save(self, path):
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump((PLAN_VERSION, self), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+
+def source_digest(source, source_format=None, version=PLAN_VERSION):
+    # sha256 of a graph (canonical, blank node ids do not matter), bytes,
+    # a file's content or serialized data
+    h = hashlib.sha256(("%d %s\n" % (version, source_format)).encode())
+    if isinstance(source, rdflib.Graph):
+        g = rdflib.Graph()
+        g += source.triples((None, None, None))
+        h.update(str(to_isomorphic(g).graph_digest()).encode())
+    elif isinstance(source, bytes):
+        h.update(source)
+    elif isinstance(source, str) and len(source) < 4096 and os.path.isfile(source):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    elif isinstance(source, str) and len(source) < 4096 and os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path):
+                h.update(("%s\n" % name).encode("utf-8"))
+                with open(path, "rb") as f:
+                    h.update(f.read())
+    else:
+        h.update(str(source).encode("utf-8"))
+    return h.hexdigest()
+
+
+def shapes_digest(shacl_graph, shacl_graph_format=None):
+    return source_digest(shacl_graph, shacl_graph_format)
+
+
+def is_json_shapes(shacl_graph, shacl_graph_format=None):
+    # a directory of JSON shapes (example/shapes/LUBM), or one such file
+    if shacl_graph_format == "json":
+        return True
+    if not isinstance(shacl_graph, str) or len(shacl_graph) >= 4096:
+        return False
+    return os.path.isdir(shacl_graph) or (shacl_graph.endswith(".json") and os.path.isfile(shacl_graph))
+
+
+def load_plan(shacl_graph, shacl_graph_format=None, cache_dir=None):
+    # a FusionPlan for the shapes, from this process, from cache_dir, or compiled
+    if isinstance(shacl_graph, FusionPlan):
+        return shacl_graph
+    digest = shapes_digest(shacl_graph, shacl_graph_format)
+    path = None if cache_dir is None else os.path.join(cache_dir, digest + ".plan")
+    plan = compiled_plans.pop(digest, None)
+    if plan is None and path is not None and os.path.exists(path):
+        with open(path, "rb") as f:
+            version, plan = pickle.load(f)
+        if version != PLAN_VERSION:
+            plan = None
+    save = path is not None and (plan is None or not os.path.exists(path))
+    if plan is None:
+        if is_json_shapes(shacl_graph, shacl_graph_format):
+            from json_shapes import json_plan
+            plan = json_plan(shacl_graph, digest)
+        else:
+            plan = FusionPlan(load_shacl_graph(shacl_graph, shacl_graph_format), digest)
+    if save: # also a plan from this process for a new cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        plan.save(path)
+    compiled_plans[digest] = plan
+    while len(compiled_plans) > COMPILED_PLANS_SIZE:
+        del compiled_plans[next(iter(compiled_plans))]
+    return plan
@@ -0,0 +1,120 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# the FusionProfile being recorded, None while profiling is off
+active = None
+
+
+class RuleStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.added = 0
+        self.removed = 0
+        self.rounds = dict() # fixpoint round -> calls in that round
+
+    def as_dict(self):
+        return {
+            "rule": self.name,
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "added": self.added,
+            "removed": self.removed,
+            "rounds": dict(self.rounds),
+        }
+
+
+class FusionProfile:
+    # Per rule call counts, time, and triples added / removed. Time and
+    # triples of a rule called from another rule count for the inner rule
+    # only, so the numbers of all rules add up to the whole fixpoint.
+
+    def __init__(self):
+        self.rules = dict()
+        self.round = 0
+        self.stack = []
+
+    def next_round(self):
+        self.round += 1
+
+    def call(self, name, f, g, args, kwargs):
+        # frame: time, added, removed spent in nested rules
+        frame = [0.0, 0, 0]
+        self.stack.append(frame)
+        added, removed = changes(g)
+        start = time.perf_counter()
+        try:
+            return f(g, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            added = changes(g)[0] - added
+            removed = changes(g)[1] - removed
+            self.stack.pop()
+            stats = self.rules.get(name)
+            if stats is None:
+                stats = self.rules[name] = RuleStats(name)
+            stats.calls += 1
+            stats.seconds += seconds - frame[0]
+            stats.added += added - frame[1]
+            stats.removed += removed - frame[2]
+            stats.rounds[self.round] = stats.rounds.get(self.round, 0) + 1
+            if len(self.stack) != 0:
+                parent = self.stack[-1]
+                parent[0] += seconds
+                parent[1] += added
+                parent[2] += removed
+
+    def as_dict(self):
+        return {
+            "rounds": self.round,
+            "rules": [stats.as_dict() for stats in self.sorted()],
+        }
+
+    def sorted(self):
+        return sorted(self.rules.values(), key=lambda stats: stats.seconds, reverse=True)
+
+    def report(self):
+        lines = ["%-24s %8s %10s %9s %9s" % ("rule", "calls", "seconds", "added", "removed")]
+        for stats in self.sorted():
+            lines.append("%-24s %8d %10.4f %9d %9d"
+                         % (stats.name, stats.calls, stats.seconds, stats.added, stats.removed))
+        lines.append("fixpoint rounds: %d" % self.round)
+        return "\n".join(lines)
+
+
+def changes(g):
+    # graphs that count their real changes (TrackingGraph, EncodedGraph)
+    return getattr(g, "additions", 0), getattr(g, "removals", 0)
+
+
+def rule(name=None):
+    def decorate(f):
+        label = name or f.__name__
+
+        @wraps(f)
+        def wrapper(g, *args, **kwargs):
+            profile = active
+            if profile is None:
+                return f(g, *args, **kwargs)
+            return profile.call(label, f, g, args, kwargs)
+        return wrapper
+    return decorate
+
+
+def next_round():
+    if active is not None:
+        active.next_round()
+
+
+@contextmanager
+def recording(profile):
+    global active
+    previous = active
+    active = profile
+    try:
+        yield profile
+    finally:
+        active = previous
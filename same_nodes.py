@@ -0,0 +1,175 @@
+from array import array
+from collections.abc import Mapping
+
+from rdflib.namespace import OWL
+
+# parent of a term that is no longer in the map
+UNUSED = -1
+
+
+class SameNodes(Mapping):
+    # focus node -> the aliases merged into it, read like the dict of sets
+    # it replaces. Terms get integer ids; an alias points to the term it
+    # was merged into (union-find with path compression), a focus node to
+    # itself, so a focus node without aliases costs one array slot instead
+    # of an empty set. The focus -> aliases ranges (offsets into one array
+    # of alias ids) are built on the first lookup after an add or merge;
+    # pop walks the merges (children) instead and keeps them.
+
+    def __init__(self, focus_nodes=()):
+        self.terms = []
+        self.ids = dict()
+        self.parent = array("q")
+        self.size = 0
+        self.ranges = None
+        self.children = dict() # id -> ids merged into it, may be stale
+        for f in focus_nodes:
+            self.add(f)
+
+    def __getstate__(self):
+        # the ids are rebuilt from the terms, the ranges on demand
+        return self.terms, self.parent, self.size
+
+    def __setstate__(self, state):
+        self.terms, self.parent, self.size = state
+        self.ids = dict((t, i) for i, t in enumerate(self.terms))
+        self.ranges = None
+        self.children = dict()
+        for i, p in enumerate(self.parent):
+            if p != i and p != UNUSED:
+                self.children.setdefault(p, []).append(i)
+
+    def id(self, term):
+        i = self.ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            self.ids[term] = i
+            self.terms.append(term)
+            self.parent.append(UNUSED)
+        return i
+
+    def find(self, i):
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root: # path compression
+            parent[i], i = root, parent[i]
+        return root
+
+    def add(self, focus):
+        # focus becomes a focus node, with no aliases if it is a new one
+        i = self.id(focus)
+        if self.parent[i] != i:
+            self.parent[i] = i
+            self.size += 1
+            self.ranges = None
+        return i
+
+    def merge(self, focus, alias):
+        # alias, and everything merged into it before, becomes an alias of focus
+        f = self.add(focus)
+        a = self.id(alias)
+        if a == f:
+            return
+        if self.parent[a] == a:
+            self.size -= 1
+        self.parent[a] = f
+        self.children.setdefault(f, []).append(a)
+        self.ranges = None
+
+    def canonical(self, term, default=None):
+        # the focus node term is an alias of, term itself for a focus node
+        i = self.ids.get(term)
+        if i is None or self.parent[i] == UNUSED:
+            return default
+        return self.terms[self.find(i)]
+
+    def index(self):
+        if self.ranges is None:
+            n = len(self.parent)
+            roots = array("q", (self.find(i) if self.parent[i] != UNUSED else UNUSED for i in range(n)))
+            start = array("q", bytes(8 * (n + 1)))
+            for i, r in enumerate(roots):
+                if r != i and r != UNUSED:
+                    start[r + 1] += 1
+            for i in range(n):
+                start[i + 1] += start[i]
+            members = array("q", bytes(8 * start[n]))
+            fill = array("q", start)
+            for i, r in enumerate(roots):
+                if r != i and r != UNUSED:
+                    members[fill[r]] = i
+                    fill[r] += 1
+            self.ranges = (start, members)
+        return self.ranges
+
+    def alias_ids(self, i):
+        start, members = self.index()
+        return members[start[i]:start[i + 1]]
+
+    def __getitem__(self, focus):
+        i = self.ids.get(focus)
+        if i is None or self.parent[i] != i:
+            raise KeyError(focus)
+        return frozenset(self.terms[a] for a in self.alias_ids(i))
+
+    def __contains__(self, focus):
+        i = self.ids.get(focus)
+        return i is not None and self.parent[i] == i
+
+    def __iter__(self):
+        parent = self.parent
+        return (self.terms[i] for i in range(len(parent)) if parent[i] == i)
+
+    def __len__(self):
+        return self.size
+
+    def pop(self, focus, *default):
+        # removes focus and its aliases from the map, returns the aliases
+        if focus not in self:
+            if len(default) != 0:
+                return default[0]
+            raise KeyError(focus)
+        i = self.ids[focus]
+        aliases = set()
+        seen = {i}
+        work = [(a, True) for a in self.children.pop(i, ())]
+        while len(work) != 0:
+            a, orphan = work.pop()
+            if a in seen:
+                continue
+            seen.add(a)
+            # path compression and later merges leave the merge tree behind:
+            # a child can belong to another focus node now while its own
+            # children still belong to i
+            if self.parent[a] != UNUSED and self.find(a) == i:
+                aliases.add(a)
+                work.extend((c, True) for c in self.children.pop(a, ()))
+                continue
+            if orphan and self.parent[a] != UNUSED and self.parent[a] != a:
+                # its merge into i is dropped, hang it on its focus node
+                self.children.setdefault(self.find(a), []).append(a)
+            work.extend((c, False) for c in self.children.get(a, ()))
+        for a in aliases:
+            self.parent[a] = UNUSED
+        self.parent[i] = UNUSED
+        self.size -= 1
+        # the ranges of the other focus nodes stay valid, those of i are
+        # no longer reachable
+        return set(self.terms[a] for a in aliases)
+
+    def clear(self):
+        self.__init__()
+
+    def to_dict(self):
+        return dict((focus, set(aliases)) for focus, aliases in self.items())
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def sameas_triples(self):
+        start, members = self.index()
+        for i in range(len(self.parent)):
+            for a in members[start[i]:start[i + 1]]:
+                yield (self.terms[i], OWL.sameAs, self.terms[a])
@@ -0,0 +1,178 @@
+import heapq
+
+from rdflib import BNode, Literal
+from rdflib.namespace import OWL, RDF, RDFS
+
+from equivalence import EquivalenceIndex
+
+# types that make their instances schema terms
+SCHEMA_CLASSES = {
+    OWL.Class,
+    RDFS.Class,
+    OWL.Restriction,
+    RDFS.Datatype,
+    RDF.Property,
+    OWL.ObjectProperty,
+    OWL.DatatypeProperty,
+    OWL.AnnotationProperty,
+    OWL.OntologyProperty,
+    OWL.FunctionalProperty,
+    OWL.InverseFunctionalProperty,
+    OWL.SymmetricProperty,
+    OWL.AsymmetricProperty,
+    OWL.TransitiveProperty,
+    OWL.IrreflexiveProperty,
+    OWL.ReflexiveProperty,
+    OWL.Ontology,
+    OWL.AllDisjointClasses,
+    OWL.AllDisjointProperties,
+}
+
+# properties linked by one of these share what the rules do with their triples
+PROPERTY_LINKS = (OWL.sameAs, OWL.equivalentProperty, RDFS.subPropertyOf, OWL.inverseOf)
+
+
+def schema_triples(g, schema_predicates):
+    # The TBox of g: triples with a schema predicate, triples about a
+    # property, a class or an instance of SCHEMA_CLASSES, and everything
+    # hanging off them through blank nodes (lists, restrictions) or sameAs.
+    # Returns (predicates, schema terms, schema triples).
+    predicates = set(g.predicates(unique=True))
+    terms = set(predicates)
+    terms.update(g.objects(None, RDF.type, unique=True))
+    for c in SCHEMA_CLASSES:
+        terms.update(g.subjects(RDF.type, c))
+    for p in schema_predicates:
+        for s, o in g.subject_objects(p):
+            terms.add(s)
+            terms.add(o)
+
+    triples = set()
+    work = list(terms)
+    while len(work) != 0:
+        t = work.pop()
+        for triple in g.triples((t, None, None)):
+            triples.add(triple)
+            o = triple[2]
+            if o not in terms and (isinstance(o, BNode) or triple[1] == OWL.sameAs):
+                terms.add(o)
+                work.append(o)
+        for s in g.subjects(OWL.sameAs, t):
+            triples.add((s, OWL.sameAs, t))
+            if s not in terms:
+                terms.add(s)
+                work.append(s)
+    for p in schema_predicates:
+        triples.update(g.triples((None, p, None)))
+    return predicates, terms, triples
+
+
+def groups(g, terms, links):
+    # schema terms connected by one of the links, in either direction
+    index = EquivalenceIndex()
+    for p in links:
+        for s, o in g.subject_objects(p):
+            if s in terms and o in terms:
+                index.union(s, o)
+    return index
+
+
+class PropertyFlags:
+    # What the rules can do with the triples of a property, for its whole
+    # group of equivalent, same, sub- and inverse properties (a coarser
+    # group only connects more, it is never wrong).
+
+    def __init__(self, g, terms, target_classes, object_targets):
+        self.index = groups(g, terms, PROPERTY_LINKS)
+        find = self.index.find
+        # prp-trp, prp-symp, prp-inv, prp-asyp create or join triples of
+        # subject and object; prp-ifp joins on the object; a target object
+        # becomes a focus node
+        self.linking = set()
+        for c in (OWL.TransitiveProperty, OWL.SymmetricProperty, OWL.AsymmetricProperty,
+                  OWL.InverseFunctionalProperty):
+            self.linking.update(find(p) for p in g.subjects(RDF.type, c))
+        for s, o in g.subject_objects(OWL.inverseOf):
+            self.linking.add(find(s))
+        self.linking.update(find(p) for p in object_targets)
+        self.functional = set(find(p) for p in g.subjects(RDF.type, OWL.FunctionalProperty))
+        self.inverse_functional = set(find(p) for p in g.subjects(RDF.type, OWL.InverseFunctionalProperty))
+
+        # prp-rng types the object; only a class that can make it a focus node
+        # or that takes part in a disjointness matters in the object's component
+        classes = groups(g, terms, (OWL.equivalentClass, OWL.sameAs, RDFS.subClassOf))
+        relevant = set(classes.find(c) for c in target_classes)
+        for p in (OWL.disjointWith, OWL.complementOf):
+            for s, o in g.subject_objects(p):
+                relevant.add(classes.find(s))
+                relevant.add(classes.find(o))
+        self.ranges = dict()
+        for p, c in g.subject_objects(RDFS.range):
+            if classes.find(c) in relevant:
+                self.ranges.setdefault(find(p), set()).add(c)
+
+    def group(self, p):
+        return self.index.find(p)
+
+
+def components(g, schema_predicates, target_classes=(), object_targets=()):
+    # Splits the ABox of g into components no fusion rule can cross. All
+    # triples of a subject stay together. A triple also connects its
+    # subject to its object if a rule can carry anything from one to the
+    # other: sameAs / differentFrom, a linking property, an object that is
+    # or can become the alias of another node (explicit sameAs, object of a
+    # functional or subject of an inverse functional property), a blank
+    # node, or a relevant range the object is not asserted to have.
+    # Classes and properties connect nothing, literals only the subjects of
+    # an inverse functional property.
+    # Returns (schema triples, list of ABox triple lists).
+    predicates, terms, tbox = schema_triples(g, schema_predicates)
+    flags = PropertyFlags(g, terms, target_classes, object_targets)
+    group = dict((p, flags.group(p)) for p in predicates)
+    active = set()
+    for p in (OWL.sameAs, OWL.differentFrom):
+        for s, o in g.subject_objects(p):
+            active.add(s)
+            active.add(o)
+    for p, root in group.items():
+        if root in flags.functional:
+            active.update(g.objects(None, p))
+        if root in flags.inverse_functional:
+            active.update(g.subjects(p, None))
+
+    # the forest is kept over integer ids, comparing terms is slow
+    ids = dict()
+    index = EquivalenceIndex()
+    abox = []
+    for triple in g.triples((None, None, None)):
+        if triple in tbox:
+            continue
+        s, p, o = triple
+        abox.append(triple)
+        x = ids.setdefault(s, len(ids))
+        index.add(x)
+        if o in terms:
+            continue
+        root = group[p]
+        if isinstance(o, Literal):
+            if root in flags.inverse_functional:
+                index.union(x, ids.setdefault((root, o), len(ids)))
+        elif isinstance(o, BNode) or o in active or root in flags.linking:
+            index.union(x, ids.setdefault(o, len(ids)))
+        elif any((o, RDF.type, c) not in g for c in flags.ranges.get(root, ())):
+            index.union(x, ids.setdefault(o, len(ids)))
+    parts = dict()
+    for triple in abox:
+        parts.setdefault(index.find(ids[triple[0]]), []).append(triple)
+    return list(tbox), list(parts.values())
+
+
+def shards_of(parts, n):
+    # packs the components into at most n shards of about the same number
+    # of triples, the largest component first into the smallest shard
+    heap = [(0, i, []) for i in range(min(n, len(parts)) or 1)]
+    for part in sorted(parts, key=len, reverse=True):
+        size, i, shard = heapq.heappop(heap)
+        shard.extend(part)
+        heapq.heappush(heap, (size + len(part), i, shard))
+    return [shard for size, i, shard in sorted(heap, key=lambda entry: entry[1])]
@@ -0,0 +1,269 @@
+import sqlite3
+import weakref
+
+import rdflib
+from rdflib import BNode, Literal, URIRef
+from rdflib.store import Store
+
+from bloom import BloomFilter
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS terms ("
+    " id INTEGER PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL,"
+    " datatype TEXT NOT NULL, lang TEXT NOT NULL, UNIQUE (kind, value, datatype, lang))",
+    "CREATE TABLE IF NOT EXISTS triples ("
+    " s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL, PRIMARY KEY (s, p, o)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS triples_pos ON triples (p, o, s)",
+    "CREATE INDEX IF NOT EXISTS triples_osp ON triples (o, s, p)",
+    "CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, uri TEXT NOT NULL)",
+)
+
+
+class Rows:
+    # the rows of an open query, read batch by batch from the cursor; the
+    # rest is read into a buffer before the store writes (snapshot)
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.buffer = []
+
+    def fetch(self, n):
+        if self.cursor is not None:
+            return self.cursor.fetchmany(n)
+        rows, self.buffer = self.buffer, []
+        return rows
+
+    def snapshot(self):
+        if self.cursor is not None:
+            self.buffer.extend(self.cursor.fetchall())
+            self.cursor = None
+
+
+class SQLiteStore(Store):
+    # A single graph in a SQLite file, for data graphs that do not fit in
+    # memory. Terms are interned into integer ids, triples are kept in one
+    # (s, p, o) table with POS and OSP indexes next to the primary key.
+    # Adds are buffered and written with executemany, the buffer is flushed
+    # before every read, so the rules always see their own writes. Reads
+    # stream their rows; the rules write while they iterate, so the rows
+    # left in open reads are fetched before each write.
+    # Membership tests (the rules test a triple before adding it) do not
+    # flush: Bloom filters answer them for new triples, the buffer itself
+    # for triples added since the last flush. The triples already in the
+    # file go into a filter over their term ids, read from the triples
+    # table without decoding a term; the triples added since the store was
+    # opened into one over the triples themselves.
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, path=":memory:", batch_size=10000, cache_size=1000000):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.connection = sqlite3.connect(path)
+        # the database is a work copy of the data, losing it on a crash is
+        # fine; without a journal there is no rollback
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("PRAGMA temp_store=MEMORY")
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.pending = dict() # ordered set
+        self.readers = weakref.WeakSet()
+        self.ids = dict()
+        self.terms = dict()
+        self.seen = BloomFilter(batch_size)
+        self.stored = None # None while the file had no triples
+        count = self.connection.execute("SELECT count(*) FROM triples").fetchone()[0]
+        if count != 0:
+            self.stored = BloomFilter(count)
+            for row in self.connection.execute("SELECT s, p, o FROM triples"):
+                self.stored.add(row)
+
+    def key(self, term):
+        if isinstance(term, Literal):
+            return ("L", str(term), str(term.datatype or ""), term.language or "")
+        if isinstance(term, BNode):
+            return ("B", str(term), "", "")
+        return ("U", str(term), "", "")
+
+    def term(self, key):
+        kind, value, datatype, lang = key
+        if kind == "L":
+            return Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None)
+        if kind == "B":
+            return BNode(value)
+        return URIRef(value)
+
+    def cache(self, term, i):
+        if len(self.ids) >= self.cache_size:
+            self.ids.clear()
+            self.terms.clear()
+        self.ids[term] = i
+        self.terms[i] = term
+
+    def encode(self, term, create=False):
+        i = self.ids.get(term)
+        if i is not None:
+            return i
+        key = self.key(term)
+        row = self.connection.execute(
+            "SELECT id FROM terms WHERE kind = ? AND value = ? AND datatype = ? AND lang = ?", key).fetchone()
+        if row is not None:
+            i = row[0]
+        elif create:
+            i = self.connection.execute(
+                "INSERT INTO terms (kind, value, datatype, lang) VALUES (?, ?, ?, ?)", key).lastrowid
+        else:
+            return None
+        self.cache(term, i)
+        return i
+
+    def decode(self, i):
+        term = self.terms.get(i)
+        if term is None:
+            row = self.connection.execute(
+                "SELECT kind, value, datatype, lang FROM terms WHERE id = ?", (i,)).fetchone()
+            term = self.term(row)
+            self.cache(term, i)
+        return term
+
+    def detach(self):
+        # the open reads take their remaining rows before the triples change
+        for rows in list(self.readers):
+            rows.snapshot()
+        self.readers = weakref.WeakSet()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        rows = [tuple(self.encode(t, create=True) for t in triple) for triple in self.pending]
+        self.pending = dict()
+        self.detach()
+        self.connection.executemany("INSERT OR IGNORE INTO triples (s, p, o) VALUES (?, ?, ?)", rows)
+
+    def where(self, triple):
+        # WHERE clause and parameters for a pattern, None if a term is unknown
+        clauses = []
+        params = []
+        for column, term in zip("spo", triple):
+            if term is None:
+                continue
+            i = self.encode(term)
+            if i is None:
+                return None
+            clauses.append("%s = ?" % column)
+            params.append(i)
+        if len(clauses) == 0:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def add(self, triple, context=None, quoted=False):
+        self.pending[triple] = None
+        self.seen.add(triple)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def addN(self, quads):
+        for s, p, o, c in quads:
+            self.add((s, p, o))
+
+    def remove(self, triple, context=None):
+        self.flush()
+        where = self.where(triple)
+        if where is not None:
+            self.detach()
+            self.connection.execute("DELETE FROM triples" + where[0], where[1])
+
+    def triples(self, triple_pattern, context=None):
+        s, p, o = triple_pattern
+        if s is not None and p is not None and o is not None:
+            # membership test, answered without a flush where possible
+            if triple_pattern not in self.seen and not self.was_stored(triple_pattern):
+                return
+            if triple_pattern in self.pending:
+                yield triple_pattern, iter(())
+                return
+        self.flush()
+        where = self.where(triple_pattern)
+        if where is None:
+            return
+        rows = Rows(self.connection.execute("SELECT s, p, o FROM triples" + where[0], where[1]))
+        self.readers.add(rows)
+        try:
+            batch = rows.fetch(self.batch_size)
+            while len(batch) != 0:
+                for s, p, o in batch:
+                    yield (self.decode(s), self.decode(p), self.decode(o)), iter(())
+                batch = rows.fetch(self.batch_size)
+        finally:
+            self.readers.discard(rows)
+
+    def was_stored(self, triple):
+        # False if the triple was not in the file when the store was opened
+        if self.stored is None:
+            return False
+        ids = tuple(self.encode(t) for t in triple)
+        return None not in ids and ids in self.stored
+
+    def __len__(self, context=None):
+        self.flush()
+        return self.connection.execute("SELECT count(*) FROM triples").fetchone()[0]
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix, namespace, override=True):
+        if not override and self.namespace(prefix) is not None:
+            return
+        self.connection.execute("DELETE FROM namespaces WHERE uri = ?", (str(namespace),))
+        self.connection.execute("INSERT OR REPLACE INTO namespaces (prefix, uri) VALUES (?, ?)",
+                                (prefix, str(namespace)))
+
+    def namespace(self, prefix):
+        row = self.connection.execute("SELECT uri FROM namespaces WHERE prefix = ?", (prefix,)).fetchone()
+        return None if row is None else URIRef(row[0])
+
+    def prefix(self, namespace):
+        row = self.connection.execute("SELECT prefix FROM namespaces WHERE uri = ?", (str(namespace),)).fetchone()
+        return None if row is None else row[0]
+
+    def namespaces(self):
+        for prefix, uri in self.connection.execute("SELECT prefix, uri FROM namespaces").fetchall():
+            yield prefix, URIRef(uri)
+
+    def commit(self):
+        self.flush()
+        self.detach()
+        self.connection.commit()
+
+    def rollback(self):
+        raise RuntimeError("SQLiteStore keeps no journal, its changes cannot be rolled back")
+
+    def close(self, commit_pending_transaction=True):
+        if commit_pending_transaction:
+            self.commit()
+        self.connection.close()
+
+
+def sqlite_graph(store):
+    # a Graph on store, a SQLiteStore or the path of its database file
+    if not isinstance(store, Store):
+        store = SQLiteStore(store)
+    return rdflib.Graph(store=store)
+
+
+def bulk_load(graph, source):
+    # parses into the store of graph; source is a Graph or parse() keywords
+    if isinstance(source, rdflib.Graph):
+        for prefix, ns in source.namespace_manager.namespaces():
+            graph.namespace_manager.bind(prefix, ns, override=True, replace=True)
+        graph.addN((s, p, o, graph) for s, p, o in source.triples((None, None, None)))
+    else:
+        graph.parse(**source)
+    graph.store.commit()
+    return graph
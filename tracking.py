@@ -0,0 +1,118 @@
+import rdflib
+from rdflib.namespace import OWL, RDFS
+
+# triples that keep a class, property or focus node from being merged
+PENDING_PREDICATES = (OWL.sameAs, OWL.equivalentClass, OWL.equivalentProperty, RDFS.subPropertyOf)
+
+
+class TrackingGraph(rdflib.Graph):
+    # a second view on the store of `graph` that remembers which triples were
+    # really new (added) or really gone (removed) since the last delta() call,
+    # and counts the pending equivalence / subproperty triples of every term
+    # so that the all_*_merged checks do not have to scan the graph.
+    # pending_terms() and touched stand in for a set of changed terms:
+    # merge_target_classes only visits the target classes with pending
+    # triples, seminaive_fixpoint adds the pending classes and path properties
+    # to the terms of its delta, and ConsistencyChecks.run only joins the
+    # nodes touched since the last round.
+
+    def __init__(self, graph, record=True):
+        super().__init__(store=graph.store, identifier=graph.identifier,
+                         namespace_manager=graph.namespace_manager)
+        self.record = record
+        self.added = set()
+        self.removed = set()
+        # real changes since the view was made, never reset, counted while recording
+        self.additions = 0
+        self.removals = 0
+        # predicate -> term -> number of pending triples touching the term,
+        # subPropertyOf only counts for its object
+        self.pending = dict((p, dict()) for p in PENDING_PREDICATES)
+        # subjects and objects of every add since the last take_touched()
+        self.touched = set()
+        for p in PENDING_PREDICATES:
+            for s, o in self.subject_objects(p):
+                self.count(s, p, o, 1)
+
+    def count(self, s, p, o, n):
+        counts = self.pending[p]
+        terms = (o,) if p == RDFS.subPropertyOf or s == o else (s, o)
+        for t in terms:
+            c = counts.get(t, 0) + n
+            if c == 0:
+                del counts[t]
+            else:
+                counts[t] = c
+
+    def add(self, triple):
+        self.touched.add(triple[0])
+        self.touched.add(triple[2])
+        if not self.record and triple[1] not in self.pending:
+            return super().add(triple)
+        if triple not in self:
+            self.additions += 1
+            if triple[1] in self.pending:
+                self.count(triple[0], triple[1], triple[2], 1)
+            if not self.record:
+                pass
+            elif triple in self.removed:
+                self.removed.discard(triple)
+            else:
+                self.added.add(triple)
+        return super().add(triple)
+
+    def addN(self, quads):
+        for s, p, o, c in quads:
+            self.add((s, p, o))
+        return self
+
+    def remove(self, triple):
+        s, p, o = triple
+        if not self.record and p is not None and p not in self.pending:
+            return super().remove(triple)
+        if s is None or p is None or o is None:
+            matches = list(self.triples(triple))
+        elif triple in self:
+            matches = [triple]
+        else:
+            return self
+        self.removals += len(matches)
+        for t in matches:
+            if t[1] in self.pending:
+                self.count(t[0], t[1], t[2], -1)
+            if not self.record:
+                pass
+            elif t in self.added:
+                self.added.discard(t)
+            else:
+                self.removed.add(t)
+        return super().remove(triple)
+
+    def delta(self):
+        added = self.added
+        self.added = set()
+        self.removed = set()
+        return added
+
+    def take_touched(self):
+        touched = self.touched
+        self.touched = set()
+        return touched
+
+    def pending_terms(self, terms, predicates):
+        # the terms that still have pending triples with one of the predicates
+        found = set()
+        for p in predicates:
+            counts = self.pending[p]
+            if len(counts) < len(terms):
+                found.update(t for t in counts if t in terms)
+            else:
+                found.update(t for t in terms if t in counts)
+        return found
+
+    def merged(self, terms, predicates):
+        for p in predicates:
+            counts = self.pending[p]
+            if len(counts) != 0 and not counts.keys().isdisjoint(terms):
+                return False
+        return True
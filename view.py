@@ -0,0 +1,94 @@
+from itertools import chain
+
+import rdflib
+from rdflib.store import Store
+
+
+class NoiselessStore(Store):
+    # A read-only view on a fused graph that only shows the triples
+    # remove_noise would keep: everything of a kept subject, plus the
+    # triples of the global path properties. Nothing is copied, patterns
+    # are answered from the indexes of the fused graph and filtered.
+
+    # the view is its own, only context; pyshacl wraps data graphs in a
+    # Dataset, which wants a context and graph aware store
+    context_aware = True
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = True
+
+    def __init__(self, graph, keep, global_path):
+        super().__init__()
+        self.graph = graph
+        self.keep = keep
+        self.global_path = global_path
+        # (size of graph, size of the view), pyshacl asks for len() a lot
+        self.size = (None, 0)
+
+    def kept(self, s, p):
+        return s in self.keep or p in self.global_path
+
+    def matches(self, triple):
+        s, p, o = triple
+        if s is not None:
+            if s in self.keep:
+                return self.graph.triples(triple)
+            if p is not None:
+                return iter(()) if p not in self.global_path else self.graph.triples(triple)
+            return (t for q in self.global_path for t in self.graph.triples((s, q, o)))
+        if p is not None:
+            if p in self.global_path:
+                return self.graph.triples(triple)
+            return (t for t in self.graph.triples(triple) if t[0] in self.keep)
+        if o is not None:
+            return (t for t in self.graph.triples(triple) if self.kept(t[0], t[1]))
+        # whole graph: the kept subjects, then the path triples of all others
+        return chain(
+            (t for x in self.keep for t in self.graph.triples((x, None, None))),
+            (t for q in self.global_path for t in self.graph.triples((None, q, None)) if t[0] not in self.keep))
+
+    def triples(self, triple_pattern, context=None):
+        for t in self.matches(triple_pattern):
+            yield t, iter(())
+
+    def __len__(self, context=None):
+        n = len(self.graph)
+        if self.size[0] != n:
+            self.size = (n, sum(1 for t in self.matches((None, None, None))))
+        return self.size[1]
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix, namespace, override=True):
+        return self.graph.store.bind(prefix, namespace, override=override)
+
+    def namespace(self, prefix):
+        return self.graph.store.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self.graph.store.prefix(namespace)
+
+    def namespaces(self):
+        return self.graph.store.namespaces()
+
+    def add(self, triple, context, quoted=False):
+        raise RuntimeError("The noiseless view of a fused graph is read-only")
+
+    def addN(self, quads):
+        raise RuntimeError("The noiseless view of a fused graph is read-only")
+
+    def remove(self, triple, context=None):
+        raise RuntimeError("The noiseless view of a fused graph is read-only")
+
+    def add_graph(self, graph):
+        raise RuntimeError("The noiseless view of a fused graph is read-only")
+
+    def remove_graph(self, graph):
+        raise RuntimeError("The noiseless view of a fused graph is read-only")
+
+
+def noiseless_view(vg, found_node_targets, target_classes, global_path):
+    # same triples as remove_noise(vg, ...), without copying or deleting any
+    store = NoiselessStore(vg, found_node_targets.union(target_classes), set(global_path))
+    return rdflib.Graph(store=store, identifier=vg.identifier, namespace_manager=vg.namespace_manager)